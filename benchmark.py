@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+"""
+工时数据处理性能基准测试
+
+按指定规模生成项目成员信息表和工时数据表，分阶段统计耗时、吞吐量和内存峰值，并校验不同计算引擎、
+读取方式的结果是否一致。结果以JSON格式输出，便于对比不同版本的性能变化。
+
+示例：
+    python3 benchmark.py --scale small medium --density low high --output bench.json
+"""
+
+import os, sys
+import argparse
+import calendar
+import json
+import random
+import subprocess
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows下无法统计内存峰值
+    resource = None
+
+from openpyxl import Workbook
+
+import worktime
+
+# 规模预设：员工人数、项目数
+SCALES = {
+    "small": {"employees": 100, "projects": 10},
+    "medium": {"employees": 5000, "projects": 200},
+    "large": {"employees": 50000, "projects": 2000},
+}
+
+# 项目重叠密度：每名员工平均参与的项目数
+DENSITIES = {"low": 1, "medium": 3, "high": 8}
+
+
+class QuietLog(worktime.LogTrace):
+    """
+    丢弃所有日志，避免输出影响计时
+    """
+
+    def log(self, level, msg):
+        pass
+
+
+def generate_project_table(filename, employees, projects, density, year, seed):
+    """
+    生成项目成员信息表，项目起止时间分布在全年，部分项目在月中开始或结束
+    """
+    rnd = random.Random(seed)
+    members = [[] for _ in range(projects)]
+    for uid in range(employees):
+        count = max(1, min(projects, int(rnd.expovariate(1 / density)) + 1))
+        for proj in rnd.sample(range(projects), count):
+            members[proj].append(f"B{uid:07d}员工{uid}")
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="项目及成员管理")
+    ws.append(["基准测试数据"])
+    ws.append(["二级项目", "开始时间", "结束时间", "项目权重（绝对值）", "项目成员"])
+    for proj in range(projects):
+        start_month = rnd.randint(1, 12) if rnd.random() < 0.3 else 1
+        start = f"{year}-{start_month:02d}-{rnd.randint(1, 28):02d}" if start_month > 1 else f"{year - 1}-06-01"
+        end_month = rnd.randint(start_month, 12)
+        end = f"{year}-{end_month:02d}-{rnd.randint(1, 28):02d}" if rnd.random() < 0.3 else f"{year + 1}-12-31"
+        if end < start:
+            end = f"{year + 1}-12-31"
+        weight = rnd.choice([None, 1, 2, 3, 5])
+        ws.append([f"基准项目{proj}", start, end, weight, ",".join(members[proj]) or None])
+    wb.save(filename)
+
+
+def generate_data(filename, employees, months, year, seed):
+    """
+    生成工时数据表，每月一个工作表，周末工时为0，工作日工时以8小时为主
+    """
+    rnd = random.Random(seed)
+    wb = Workbook(write_only=True)
+    for month in range(1, months + 1):
+        ws = wb.create_sheet(title=f"{month}月")
+        _, days = calendar.monthrange(year, month)
+        weekdays = [calendar.weekday(year, month, day) < 5 for day in range(1, days + 1)]
+        ws.append(["工号", "姓名", "一级部门", "二级部门", "三级部门", "四级部门", "合计"] +
+                  [f"{day}日" for day in range(1, days + 1)])
+        for uid in range(employees):
+            # 约1%的员工不在项目成员信息表中
+            sid = f"B{uid:07d}" if rnd.random() > 0.01 else f"X{uid:07d}"
+            costs = [rnd.choice([8, 8, 8, 8, 7.5, 4, 0]) if weekday else 0 for weekday in weekdays]
+            ws.append([sid, f"员工{uid}", "研发中心", "平台部", "一组", "", sum(costs)] + costs)
+    wb.save(filename)
+
+
+def peak_rss():
+    """
+    当前进程的内存峰值（KB）
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def timed(phases, name, rows, func, *args):
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = func(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    phases[name] = {"wall": round(wall, 4), "cpu": round(cpu, 4), "rows": rows,
+                    "rows_per_sec": round(rows / wall, 1) if wall > 0 and rows else None}
+    return result
+
+
+def analyse_rows(productor, sheets, yearname):
+    return [list(productor.sheet_records(rows, sheet_name, yearname)) for sheet_name, rows in sheets]
+
+
+def first_sheet(case, mode=None):
+    """
+    从开始解析项目成员信息表到第一个月份分析完成
+    :param mode: None 依次读取；thread、process 解析项目成员信息表的同时在线程或子进程中预读第一个月份，见Prefetch
+    """
+    log = QuietLog()
+    prefetch = None
+    if mode is not None:
+        prefetch = worktime.Prefetch(case["data_file"], case["reader"], thread=mode == "thread")
+    try:
+        pminfo = worktime.ProjectMemenbers(case["project_file"], log, reader=case["reader"])
+        pminfo.parser()
+        productor = worktime.DataProduct(case["data_file"], pminfo, log, engine=case["engine"], reader=case["reader"])
+        productor.prefetch = prefetch
+        yearname, wb = productor.open_workbook()
+        sheet_name = wb.sheetnames[0]
+        productor.sheet_parser(wb[sheet_name], sheet_name, yearname)
+        wb.close()
+    finally:
+        if prefetch is not None:
+            prefetch.close()
+
+
+def run_case(case):
+    """
+    在当前进程中执行一组基准测试，内存峰值只反映本组测试
+    """
+    log = QuietLog()
+    phases = {}
+    project_file, data_file = case["project_file"], case["data_file"]
+    yearname = str(case["year"])
+
+    # 首月耗时：依次读取与预读第一个月份对比，预读需要多核才能与项目成员信息表的解析同时进行
+    timed(phases, "first_sheet", case["employees"], first_sheet, case)
+    timed(phases, "first_sheet_thread", case["employees"], first_sheet, case, "thread")
+    timed(phases, "first_sheet_process", case["employees"], first_sheet, case, "process")
+
+    pminfo = worktime.ProjectMemenbers(project_file, log, reader=case["reader"])
+    timed(phases, "project_parser", case["projects"], pminfo.parser)
+
+    productor = worktime.DataProduct(data_file, pminfo, log, engine=case["engine"], reader=case["reader"])
+    rows = case["employees"] * case["months"]
+    timed(phases, "data_parser", rows, productor.parser)
+
+    # 单独统计工时分析耗时：先读取原始数据，再分析
+    wb = worktime.load_xlsx(data_file, case["reader"])
+    sheets = [(name, list(productor.sheet_rows(wb[name], name, yearname))) for name in wb.sheetnames]
+    wb.close()
+    analyser = worktime.DataProduct(data_file, pminfo, log, engine=case["engine"])
+    timed(phases, "time_analysis", rows, analyse_rows, analyser, sheets, yearname)
+    del sheets
+
+    outfile = os.path.join(case["workdir"], f"TimeResults_{case['engine']}_{case['reader']}.xlsx")
+    output_rows = sum(records.summary()[2] for month_data in productor.data.values() for records in month_data.values())
+    timed(phases, "writer", output_rows, productor.writer, outfile)
+
+    result = {key: case[key] for key in ("scale", "density", "employees", "projects", "months", "engine", "reader")}
+    result["phases"] = phases
+    result["peak_rss_kb"] = peak_rss()
+
+    # 校验其它计算引擎、读取方式的结果是否与本次一致
+    if case["verify"]:
+        identical = True
+        for engine, reader in case["variants"]:
+            if (engine, reader) == (case["engine"], case["reader"]):
+                continue
+            other = worktime.DataProduct(data_file, pminfo, log, engine=engine, reader=reader)
+            other.parser()
+            identical = identical and other.data == productor.data
+        result["identical"] = identical
+    return result
+
+
+def prepare(workdir, scale, density, months, year, seed):
+    """
+    生成测试数据，已存在时直接复用
+    """
+    conf = SCALES[scale]
+    folder = os.path.join(workdir, f"{scale}-{density}-{months}")
+    os.makedirs(folder, exist_ok=True)
+    project_file = os.path.join(folder, "项目成员信息表.xlsx")
+    data_file = os.path.join(folder, f"基准工时数据-{year}.xlsx")
+    if not os.path.isfile(project_file):
+        generate_project_table(project_file, conf["employees"], conf["projects"], DENSITIES[density], year, seed)
+    if not os.path.isfile(data_file):
+        generate_data(data_file, conf["employees"], months, year, seed)
+    return folder, project_file, data_file
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="工时数据处理性能基准测试")
+    parser.add_argument("--scale", nargs="+", choices=list(SCALES), default=["small"], help="数据规模")
+    parser.add_argument("--density", nargs="+", choices=list(DENSITIES), default=["medium"], help="项目重叠密度")
+    parser.add_argument("--months", type=int, default=12, help="月份数")
+    parser.add_argument("--year", type=int, default=2021, help="数据年份")
+    parser.add_argument("--engine", nargs="+", choices=["python", "numpy"], default=["python"], help="计算引擎")
+    parser.add_argument("--reader", nargs="+", choices=["fast", "openpyxl"], default=["fast"], help="读取方式")
+    parser.add_argument("--verify", action=argparse.BooleanOptionalAction, default=True,
+                        help="校验不同计算引擎、读取方式的结果是否一致")
+    parser.add_argument("--workdir", default=None, help="测试数据目录，默认使用临时目录")
+    parser.add_argument("--seed", type=int, default=2021, help="随机数种子")
+    parser.add_argument("--output", default=None, help="结果JSON文件，默认输出到标准输出")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)  # 子进程内部使用
+    args = parser.parse_args(argv[1:])
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case)), ensure_ascii=False))
+        return True
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="worktime-bench-")
+    engines = [engine for engine in args.engine if engine != "numpy" or worktime.numpy is not None]
+    variants = [[engine, reader] for engine in ["python", "numpy"] if engine == "python" or worktime.numpy is not None
+                for reader in ["fast", "openpyxl"]]
+    results = []
+    for scale in args.scale:
+        for density in args.density:
+            folder, project_file, data_file = prepare(workdir, scale, density, args.months, args.year, args.seed)
+            for engine in engines:
+                for reader in args.reader:
+                    case = dict(SCALES[scale], scale=scale, density=density, months=args.months, year=args.year,
+                                engine=engine, reader=reader, workdir=folder, project_file=project_file,
+                                data_file=data_file, verify=args.verify, variants=variants)
+                    # 每组测试在独立进程中执行，使内存峰值互不影响
+                    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                                          stdout=subprocess.PIPE, check=True)
+                    results.append(json.loads(proc.stdout.decode("utf-8")))
+                    print(f"{scale}/{density}/{engine}/{reader}: " +
+                          ", ".join(f"{name} {phase['wall']}s" for name, phase in results[-1]["phases"].items()),
+                          file=sys.stderr)
+
+    report = json.dumps({"python": sys.version.split()[0], "workdir": workdir, "cases": results},
+                        ensure_ascii=False, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    return all(result.get("identical", True) for result in results)
+
+
+if '__main__' == __name__:
+    sys.exit(0 if main(sys.argv) else 1)
@@ -2,27 +2,496 @@
 # -*- coding: UTF-8 -*-
 
 import os, sys
+import argparse
+import contextlib
+import cProfile
+import glob
+import json
 import time
 import calendar
+import copy
+import csv
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib.util
+import multiprocessing
+import pickle
+import posixpath
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import threading
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from xml.etree.ElementTree import iterparse, fromstring
 
 from openpyxl import Workbook, load_workbook
-from openpyxl.utils import get_column_letter
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.datetime import from_excel, from_ISO8601, MAC_EPOCH, WINDOWS_EPOCH
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+from openpyxl.formula.translate import Translator
+from openpyxl.worksheet.formula import ArrayFormula, DataTableFormula
+
+try:
+    import numpy
+except ImportError:  # NumPy为可选依赖，未安装时只能使用纯Python计算引擎
+    numpy = None
+
+try:
+    import resource
+except ImportError:  # Windows下无法统计内存峰值
+    resource = None
+
+# 图形界面依赖在启动界面时才导入，命令行模式下无需安装tkinter
+tk = None
+askopenfilename = None
+ScrolledText = None
+
+
+def _import_tkinter():
+    global tk, askopenfilename, ScrolledText
+    import tkinter as tk
+    from tkinter.filedialog import askopenfilename
+    from tkinter.scrolledtext import ScrolledText
+
+def _local_tag(tag):
+    # 去掉XML命名空间，兼容不同命名空间的xlsx文件
+    return tag.rsplit('}', 1)[-1]
+
+
+def _cast_number(value):
+    # 与openpyxl一致，带小数点或指数的为浮点数，其余为整数
+    if "." in value or "E" in value or "e" in value:
+        return float(value)
+    return int(value)
+
+
+def _rich_text(node):
+    # 拼接富文本中的所有文本片段，忽略拼音注释
+    snippets = []
+    for child in node:
+        tag = _local_tag(child.tag)
+        if tag == 't':
+            snippets.append(child.text or '')
+        elif tag == 'r':
+            for run in child:
+                if _local_tag(run.tag) == 't':
+                    snippets.append(run.text or '')
+    return ''.join(snippets)
+
+
+class XlsxSheet:
+    """
+    快速读取的工作表，按行返回单元格值，行为与openpyxl只读工作表的iter_rows(values_only=True)一致
+    """
+
+    def __init__(self, reader, title, path):
+        self.reader = reader
+        self.title = title
+        self.path = path
+        self.dimension = None  # (min_col, min_row, max_col, max_row)
+        self.namespace = None  # 工作表XML的命名空间，读取数据范围时获取
+
+    @property
+    def max_column(self):
+        return self.get_dimension()[2]
+
+    @property
+    def max_row(self):
+        return self.get_dimension()[3]
+
+    def recorded_dimension(self):
+        """
+        表格中记录的数据范围，只读取工作表XML的开头部分，未记录时返回None
+        """
+        if self.dimension is not None:
+            return self.dimension
+        with self.reader.archive.open(self.path) as src:
+            for _, element in iterparse(src, events=("start",)):
+                tag = _local_tag(element.tag)
+                if tag == 'worksheet':
+                    self.namespace = element.tag[:-len(tag)]
+                elif tag == 'dimension':
+                    self.dimension = range_boundaries(element.get('ref'))
+                    return self.dimension
+                elif tag == 'sheetData':
+                    break
+        return None
+
+    def get_dimension(self):
+        if self.recorded_dimension() is not None:
+            return self.dimension
+
+        # 表格中未记录数据范围，遍历全表计算
+        max_row = max_col = 0
+        for idx, cells in self.parse():
+            max_row = idx
+            if len(cells) > 0:
+                max_col = max(max_col, cells[-1][0])
+        self.dimension = (1, 1, max_col, max_row)
+        return self.dimension
+
+    def parse(self):
+        """
+        增量解析工作表XML
+        :return: 生成器，依次产生(行号, [(列号, 单元格值), ...])
+        """
+        reader = self.reader
+        if self.namespace is None:
+            self.get_dimension()
+        shared_strings = reader.get_shared_strings()
+        shared_formulae = {}
+        row_tag, value_tag, formula_tag, inline_tag = [self.namespace + tag for tag in ('row', 'v', 'f', 'is')]
+        row_counter = 0
+        with reader.archive.open(self.path) as src:
+            for _, element in iterparse(src):
+                if element.tag != row_tag:
+                    continue
+
+                index = element.get('r')
+                row_counter = int(float(index)) if index is not None else row_counter + 1
+                col_counter = 0
+                cells = []
+                for cell in element:
+                    coordinate = cell.get('r')
+                    if coordinate:
+                        col_counter = reader.column_index(coordinate)
+                    else:
+                        col_counter += 1
+
+                    data_type = cell.get('t', 'n')
+                    if data_type == 'inlineStr':
+                        value = None
+                    else:
+                        value = cell.findtext(value_tag) or None
+
+                    formula = cell.find(formula_tag)
+                    if formula is not None:
+                        value = "="
+                        if formula.text is not None:
+                            value += formula.text
+                        formula_type = formula.get('t')
+                        if formula_type == "array":
+                            value = ArrayFormula(ref=formula.get('ref'), text=value)
+                        elif formula_type == "shared":
+                            si = formula.get('si')
+                            if si in shared_formulae:
+                                value = shared_formulae[si].translate_formula(coordinate)
+                            elif value != "=":
+                                shared_formulae[si] = Translator(value, coordinate)
+                        elif formula_type == "dataTable":
+                            value = DataTableFormula(**formula.attrib)
+                    elif value is not None:
+                        if data_type == 'n':
+                            value = _cast_number(value)
+                            style_id = cell.get('s')
+                            if style_id and int(style_id) in reader.date_formats:
+                                try:
+                                    value = from_excel(value, reader.epoch,
+                                                       timedelta=int(style_id) in reader.timedelta_formats)
+                                except (OverflowError, ValueError):
+                                    value = "#VALUE!"
+                        elif data_type == 's':
+                            value = shared_strings[int(value)]
+                        elif data_type == 'b':
+                            value = bool(int(value))
+                        elif data_type == 'd':
+                            value = from_ISO8601(value)
+                    elif data_type == 'inlineStr':
+                        inline = cell.find(inline_tag)
+                        if inline is not None:
+                            value = _rich_text(inline)
+                    cells.append((col_counter, value))
+
+                element.clear()
+                yield row_counter, cells
+
+    def iter_rows(self, min_row=1, max_col=None, values_only=True):
+        """
+        按行读取单元格值，缺失的行和单元格以None补齐
+        """
+        if not values_only:
+            raise ValueError("快速读取模式仅支持按值读取")
+        max_col = max_col or self.max_column
+        max_row = self.max_row
+        empty_row = (None,) * max_col
+
+        counter = min_row
+        idx = 1
+        for idx, cells in self.parse():
+            if max_row is not None and idx > max_row:
+                break
+
+            # 补齐缺失的行
+            for _ in range(counter, idx):
+                counter += 1
+                yield empty_row
+
+            if counter <= idx:
+                row = [None] * max_col
+                for column, value in cells:
+                    if column <= max_col:
+                        row[column - 1] = value
+                counter += 1
+                yield tuple(row)
+
+        if max_row is not None and max_row < idx:
+            for _ in range(counter, max_row + 1):
+                yield empty_row
+
+    @property
+    def rows(self):
+        return self.iter_rows()
+
+
+class XlsxReader:
+    """
+    xlsx快速读取，直接增量解析压缩包中的工作表XML和共享字符串，不创建openpyxl单元格对象
+    """
+
+    def __init__(self, xlsx):
+        self.archive = zipfile.ZipFile(xlsx)
+        self.shared_strings = None
+        self.columns = {}  # 列字母与列号的对应缓存
+        self.epoch = WINDOWS_EPOCH
+        self.date_formats = set()
+        self.timedelta_formats = set()
+        self.sheets = []  # [(工作表名称, XML路径)]
+        self.active_index = 0
+
+        workbook_path = self.find_part("", "/officeDocument")
+        rels = self.read_rels(workbook_path)
+        workbook = fromstring(self.archive.read(workbook_path))
+        for node in workbook.iter():
+            tag = _local_tag(node.tag)
+            if tag == 'workbookPr' and node.get('date1904') in ('1', 'true'):
+                self.epoch = MAC_EPOCH
+            elif tag == 'workbookView' and node.get('activeTab') is not None:
+                self.active_index = int(node.get('activeTab'))
+            elif tag == 'sheet':
+                rid = [v for k, v in node.attrib.items() if _local_tag(k) == 'id'][0]
+                self.sheets.append((node.get('name'), rels[rid][1]))
+
+        for kind, target in rels.values():
+            if kind.endswith("/styles"):
+                self.read_styles(target)
+
+    def find_part(self, source, kind):
+        for rel_kind, target in self.read_rels(source).values():
+            if rel_kind.endswith(kind):
+                return target
+        raise KeyError(f"{kind} not found")
+
+    def read_rels(self, source):
+        """
+        读取关系文件
+        :return: {关系ID: (关系类型, 目标文件在压缩包中的路径)}
+        """
+        folder, name = posixpath.split(source)
+        rels_path = posixpath.join(folder, "_rels", f"{name}.rels")
+        rels = {}
+        for node in fromstring(self.archive.read(rels_path)):
+            target = node.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            rels[node.get('Id')] = (node.get('Type'), target)
+        return rels
+
+    def read_styles(self, path):
+        # 记录日期、时间格式的样式，与openpyxl一致将这些数值单元格转换为日期
+        custom = {}
+        cell_formats = []
+        styles = fromstring(self.archive.read(path))
+        for node in styles:
+            tag = _local_tag(node.tag)
+            if tag == 'numFmts':
+                for fmt in node:
+                    custom[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+            elif tag == 'cellXfs':
+                cell_formats = [int(xf.get('numFmtId', 0)) for xf in node]
+        for idx, fmt_id in enumerate(cell_formats):
+            fmt = custom[fmt_id] if fmt_id in custom else BUILTIN_FORMATS.get(fmt_id)
+            if is_date_format(fmt):
+                self.date_formats.add(idx)
+            if is_timedelta_format(fmt):
+                self.timedelta_formats.add(idx)
+
+    def get_shared_strings(self):
+        if self.shared_strings is not None:
+            return self.shared_strings
+        self.shared_strings = []
+        workbook_path = self.find_part("", "/officeDocument")
+        for kind, target in self.read_rels(workbook_path).values():
+            if not kind.endswith("/sharedStrings"):
+                continue
+            with self.archive.open(target) as src:
+                for _, node in iterparse(src):
+                    if _local_tag(node.tag) == 'si':
+                        self.shared_strings.append(_rich_text(node).replace('x005F_', ''))
+                        node.clear()
+        return self.shared_strings
+
+    def column_index(self, coordinate):
+        letters = coordinate.rstrip("0123456789")
+        column = self.columns.get(letters)
+        if column is None:
+            column = self.columns[letters] = column_index_from_string(letters)
+        return column
+
+    @property
+    def sheetnames(self):
+        return [name for name, _ in self.sheets]
+
+    @property
+    def active(self):
+        name, path = self.sheets[self.active_index]
+        return XlsxSheet(self, name, path)
+
+    def __getitem__(self, name):
+        for title, path in self.sheets:
+            if title == name:
+                return XlsxSheet(self, title, path)
+        raise KeyError(f"Worksheet {name} does not exist.")
+
+    def close(self):
+        self.archive.close()
+
+
+def load_xlsx(xlsx, reader="auto"):
+    """
+    以只读方式打开xlsx文件
+    :param reader: fast 直接解析xlsx文件，openpyxl 使用openpyxl只读模式，auto 优先fast，无法解析时使用openpyxl
+    """
+    if reader != "openpyxl":
+        try:
+            return XlsxReader(xlsx)
+        except Exception:
+            if reader == "fast":
+                raise
+    return load_workbook(xlsx, read_only=True)
+
+
+class ResultCache:
+    """
+    工时分析结果的磁盘缓存，按最近使用时间淘汰，限制缓存文件数量及总大小
+    """
+
+    VERSION = 3  # 分析算法或结果格式变化时递增，使旧的缓存失效
+
+    def __init__(self, path, max_entries=240, max_bytes=1 << 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, *parts):
+        return hashlib.sha256(pickle.dumps((self.VERSION,) + parts, protocol=4)).hexdigest()
+
+    def get(self, key):
+        filename = os.path.join(self.path, f"{key}.pkl")
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(filename)  # 记录最近使用时间
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return value
+
+    def put(self, key, value):
+        # 先写临时文件再替换，避免多个进程同时写入时读到不完整的缓存
+        filename = os.path.join(self.path, f"{key}.pkl")
+        tmpname = f"{filename}.{os.getpid()}.tmp"
+        with open(tmpname, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+
+    def evict(self):
+        """
+        淘汰最久未使用的缓存，直到数量和总大小均不超过上限
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".pkl"):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filename))
+
+        total = 0
+        for idx, (_, size, filename) in enumerate(sorted(entries, reverse=True)):
+            total = total + size
+            if idx >= self.max_entries or total > self.max_bytes:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+
+class AllocationMemo:
+    """
+    按日工时分配结果的有界LRU缓存：大多数员工每天在相同的项目组合上登记相同的工时，
+    同一 (工时, 活动模式, 项目数) 的分配结果只计算一次
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.runs = 0  # 与前一日相同、直接复用前一日结果的次数，见DataProduct.time_analysis
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def counts(self):
+        return {"memo_hits": self.hits, "memo_misses": self.misses, "memo_runs": self.runs}
 
-import tkinter as tk
-from tkinter.filedialog import askopenfilename
-from tkinter.scrolledtext import ScrolledText
 
 class ProjectMemenbers:
     """
     项目信息表
     """
 
-    def __init__(self, xlsx, log=None, checked=False):
+    SNAPSHOT_VERSION = 1  # 快照格式变化时递增，使旧的快照失效
+
+    def __init__(self, xlsx, log=None, checked=False, reader="auto"):
         self.xlsx = xlsx
         self.projects = {}
         self.members = {}
         self.log = log
         self.checked = checked
+        self.reader = reader  # 表格读取方式，见load_xlsx
+        self.project_digest = None
+        self.default_end = None  # 结束时间为空的项目按当天日期处理，记录该日期用于判断快照是否过期
+        self.snapshot = None  # (快照文件, 源文件信息)
+
+        # 月度索引缓存，均按 (年份, 月份) 惰性构建，同一月份只计算一次
+        self.month_spans = {}  # 项目在当月的日序号区间
+        self.month_members = {}  # 员工当月参与的项目列表
+        self.calendars = {}  # 项目组合的逐日活动日历
+        self.memo = AllocationMemo()  # 按日工时分配结果缓存，见scale_of、cents_of
 
     def valid_date(self, start, end):
         if len(start) != 10 or len(end) != 10:
@@ -35,24 +504,25 @@ class ProjectMemenbers:
         return True
 
     def valid_parser(self, row):
-        project_name = row[0].value
+        project_name = row[0]
         if project_name is None:
             self.log.error("表格中存在二级项目名称为空！")
             return False
 
-        project_start = row[1].value
+        project_start = row[1]
         if project_start is None:
             self.log.error(f"项目{project_name}的起始时间不能为空！")
             return False
 
-        project_end = row[2].value
+        project_end = row[2]
         if project_end is None:
             project_end = time.strftime("%Y-%m-%d", time.localtime())
+            self.default_end = project_end
 
         if not self.valid_date(project_start, project_end):
             return False
 
-        project_weight = row[3].value
+        project_weight = row[3]
         if project_weight is None:
             project_weight = 1
         else:
@@ -60,7 +530,7 @@ class ProjectMemenbers:
                 self.log.warn(f"{project_weight}必须为数字！")
                 return False
 
-        namelist = row[4].value
+        namelist = row[4]
         self.projects[project_name.strip()] = {'start': project_start.strip(),
                                                'end': project_end.strip(),
                                                'weight': project_weight}
@@ -84,217 +554,1886 @@ class ProjectMemenbers:
                 self.members[uid] = [project]
         return True
 
-    def get_time_scale(self, sid, sname, cost, record_projects, year, month, date):
+    def digest(self):
+        """
+        项目成员信息的哈希值，用于判断缓存的分析结果是否可用
+        """
+        if self.project_digest is None:
+            self.project_digest = hashlib.sha256(pickle.dumps((self.projects, self.members), protocol=4)).hexdigest()
+        return self.project_digest
+
+    def month_index(self, year, month):
+        """
+        构建某月的项目区间索引
+        :return: {项目名称: (当月是否参与, 起始日序号, 结束日序号)}，日序号从0开始，区间左闭右开
+        """
+        index = self.month_spans.get((year, month))
+        if index is not None:
+            return index
+
+        # 日期字符串与项目起止时间的比较规则保持不变，只是每月只比较一次，通过二分查找转换为整数日序号
+        days = [f"{year}-{month}-{d:02d}" for d in range(1, 32)]
+        month_fmt = f"{year}-{month}"
+        index = {}
+        for name, proj in self.projects.items():
+            index[name] = (proj['start'][:7] <= month_fmt <= proj['end'][:7],
+                           bisect_left(days, proj['start']),
+                           bisect_right(days, proj['end']))
+        self.month_spans[(year, month)] = index
+        return index
+
+    def month_calendar(self, names, year, month):
+        """
+        获取项目组合在某月的逐日活动日历，参与相同项目组合的员工共用同一份日历
+        :param names: 项目名称元组，顺序与get_month_projects返回的一致
+        :return: {日期(两位数字): 活动模式}，活动模式为(活动项目下标, 活动项目权重, 权重之和)，当日无活动项目时为None
+        """
+        calendars = self.calendars.setdefault((year, month), {})
+        days = calendars.get(names)
+        if days is not None:
+            return days
+
+        spans = self.month_index(year, month)
+        patterns = {}  # 相同的活动项目集合共用同一个模式，权重分母只计算一次
+        days = {}
+        for day in range(0, 31):
+            positions = tuple(pos for pos, name in enumerate(names) if spans[name][1] <= day < spans[name][2])
+            if len(positions) <= 0:
+                days["{0:>02d}".format(day + 1)] = None
+                continue
+            if positions not in patterns:
+                weights = tuple(self.projects[names[pos]]['weight'] for pos in positions)
+                patterns[positions] = (positions, weights, sum(weights))
+            days["{0:>02d}".format(day + 1)] = patterns[positions]
+        calendars[names] = days
+        return days
+
+    def day_active(self, cost, record_projects, year, month, date):
+        """
+        查询某日工时可以落入的项目
+        :return: 当日的活动模式，见month_calendar；工时为0、工时数据错误或处于项目空档期时返回None
+        """
+
+        # 工时数据错误（如文本、日期）按0处理，由Validator报告
+        if not isinstance(cost, (int, float)):
+            return None
+
+        # 当日未到岗，或者尚未加入项目，工时为0
+        if int(cost) == 0:
+            return None
+
+        # 从月度日历中查询当日参与的项目，当日为项目空窗期时为None，相当于当日没有任何项目可以落工时
+        names = tuple(proj[0] for proj in record_projects)
+        return self.month_calendar(names, year, month)[date]
+
+    def scale_of(self, cost, pattern, width):
+        """
+        按活动模式分配某日工时，分配结果缓存在memo中
+        :param pattern: 当日的活动模式，见day_active
+        :param width: 当月参与的项目数
+        :return: [ project_cost, project_cost2, project_cost3 ] 在每个项目上分配的工时
+        """
+        if pattern is None:
+            return [0.00] * width
+        key = (cost, pattern, width)
+        cached = self.memo.get(key)
+        if cached is not None:
+            return list(cached)
+
+        # 计算分子（每个项目分配的工时时长，保留小数点后两位）
+        # judge_value 修正由于未除尽导致精度缺失，列表中最后一个项目工时 = cost - 前面项目工时之和
+        positions, weights, sum_weight = pattern
+        time_cost = [0.00] * width
+        judge_value = 0.00
+        for idx in range(0, len(positions) - 1):
+            time_cost[positions[idx]] = round((weights[idx] / sum_weight) * cost, 2)
+            judge_value = judge_value + time_cost[positions[idx]]
+        time_cost[positions[-1]] = round(cost - judge_value, 2)
+        self.memo.put(key, tuple(time_cost))
+
+        # 返回所有需要记录项目当日的工时时值
+        return time_cost
+
+    def cents_of(self, cost, pattern, width, largest=False):
+        """
+        按活动模式以整数分分配某日工时，分配结果缓存在memo中，参数见scale_of
+        """
+        if pattern is None:
+            return [0] * width
+        key = (cost, pattern, width, largest)
+        cached = self.memo.get(key)
+        if cached is not None:
+            return list(cached)
+
+        time_cost = [0] * width
+        cents = int(round(cost * 100))
+        for pos, share in zip(pattern[0], self.split_cents(cents, pattern, largest)):
+            time_cost[pos] = share
+        self.memo.put(key, tuple(time_cost))
+        return time_cost
+
+    @staticmethod
+    def split_cents(cents, pattern, largest=False):
+        """
+        按权重将整数工时分配到当日参与的项目
+        """
+        positions, weights, sum_weight = pattern
+        if len(positions) == 1:
+            return [cents]
+        if largest:
+            # 先按权重向下取整，剩余的分按余数从大到小逐个补足，余数相同时靠前的项目优先
+            quotas = [divmod(cents * weight, sum_weight) for weight in weights]
+            shares = [quota for quota, _ in quotas]
+            order = sorted(range(len(quotas)), key=lambda idx: -quotas[idx][1])
+            for idx in order[:cents - sum(shares)]:
+                shares[idx] += 1
+            return shares
+        # 除最后一个项目外四舍五入，最后一个项目 = cents - 前面项目工时之和
+        shares = [(2 * cents * weight + sum_weight) // (2 * sum_weight) for weight in weights[:-1]]
+        shares.append(cents - sum(shares))
+        return shares
+
+    def get_month_projects(self, sid, sname, year, month):
+        if sid not in self.members.keys():
+            return None
+
+        # 当月任何一天在项目中记录了工时，那么全月该项目都要记录工时，如在8月31日时记录A项目工时
+        # 那么本月需要增加全月A项目的工时记录，除8月31日之外的日期记录为0，只是为了保持记录整齐
+        members = self.month_members.setdefault((year, month), {})
+        names = members.get(sid)
+        if names is None:
+            spans = self.month_index(year, month)
+            names = tuple(name for name in self.members[sid] if spans[name][0])
+            members[sid] = names
+
+        return [[name, 0] for name in names]
+
+    def print(self):
+        for k, v in self.members.items():
+            print(k, v)
+
+        for k, v in self.projects.items():
+            print(k, v)
+
+    def parser(self):
+        self.log.info(f"正在读取项目成员信息表[{self.xlsx}] ...")
+        wb = load_xlsx(self.xlsx, self.reader)
+        ws = wb.active
+        if ws.title != "项目及成员管理":
+            self.log.error(f"导入的的项目成员信息表{self.xlsx}数据内容错误，请确认是否导入了正确的表？")
+            wb.close()
+            return False
+        for row in ws.iter_rows(min_row=3, values_only=True):
+            # 如果项目没有成员，则忽略
+            if row[4] is None:
+                continue
+            if not self.valid_parser(row):
+                wb.close()
+                return False
+        wb.close()
+
+        self.log.info(f"项目成员信息数据读取成功。")
+        # self.print()
+        return True
+
+    def load(self, cache_dir=None):
+        """
+        读取项目成员信息表，源文件的路径、修改时间和大小均未变化时直接加载数据快照，否则重新解析并生成快照
+        :param cache_dir: 快照保存目录，为None时不使用快照
+        """
+        if cache_dir is None:
+            return self.parser()
+
+        path = os.path.abspath(self.xlsx)
+        stat = os.stat(path)
+        source = (self.SNAPSHOT_VERSION, path, stat.st_mtime_ns, stat.st_size)
+        filename = os.path.join(cache_dir, f"project-{hashlib.sha1(path.encode()).hexdigest()}.snapshot")
+        try:
+            with open(filename, 'rb') as f:
+                snapshot = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            snapshot = None
+
+        self.snapshot = (filename, source)
+        today = time.strftime("%Y-%m-%d", time.localtime())
+        if snapshot is not None and snapshot['source'] == source and snapshot['default_end'] in (None, today):
+            self.projects = snapshot['projects']
+            self.members = snapshot['members']
+            self.project_digest = snapshot['digest']
+            self.default_end = snapshot['default_end']
+            self.month_spans = snapshot['month_spans']
+            self.month_members = snapshot['month_members']
+            self.calendars = snapshot['calendars']
+            self.log.info(f"项目成员信息表[{self.xlsx}]未变化，已加载数据快照。")
+            return True
+
+        if not self.parser():
+            return False
+        self.save_snapshot()
+        return True
+
+    def save_snapshot(self):
+        """
+        保存项目成员信息及已构建的月度索引快照
+        """
+        if self.snapshot is None:
+            return
+        filename, source = self.snapshot
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpname = f"{filename}.{os.getpid()}.tmp"
+        with open(tmpname, 'wb') as f:
+            pickle.dump({'source': source,
+                         'default_end': self.default_end,
+                         'projects': self.projects,
+                         'members': self.members,
+                         'digest': self.digest(),
+                         'month_spans': self.month_spans,
+                         'month_members': self.month_members,
+                         'calendars': self.calendars}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, filename)
+
+
+def month_key(yearname, sheet_name):
+    # 汇总及数据库中使用的月份，如 2021-01
+    return f"{yearname}-{int(sheet_name.replace('月', '')):02d}"
+
+
+class MonthResult:
+    """
+    某月工时分析结果的紧凑存储
+    员工基本信息及项目列表每人只保存一份，各项目的当月工时汇总及按日分配的工时分别连续存放在双精度数组中，
+    按日分配的工时以 日×项目 的顺序存放，写入结果表时按项目跨步切片，无需转置
+    """
+
+    def __init__(self, header):
+        self.header = header  # 表头
+        self.staff = []  # 每位员工：(基本信息元组, 项目名称元组, 汇总偏移, 工时偏移, 天数)
+        self.totals = array('d')  # 员工×项目 的当月工时汇总
+        self.costs = array('d')  # 员工×日×项目 的工时
+
+    @classmethod
+    def collect(cls, records):
+        """
+        由sheet_records产生的表头及员工分析结果构建
+        """
+        records = iter(records)
+        result = cls(next(records, None))
+        for info in records:
+            result.append(info)
+        return result
+
+    def append(self, info):
+        """
+        追加一位员工的分析结果，info格式见DataProduct.time_analysis
+        """
+        self.staff.append((tuple(info[:6]), tuple(info[6]), len(self.totals), len(self.costs), len(info) - 8))
+        self.totals.extend(info[7])
+        for time_cost in info[8:]:
+            self.costs.extend(time_cost)
+
+    def summary(self):
+        """
+        :return: (员工数, 按日分配工时的次数, 展开后的输出行数)
+        """
+        return (len(self.staff), sum(days for _, _, _, _, days in self.staff),
+                sum(len(names) for _, names, _, _, _ in self.staff))
+
+    def lines(self):
+        """
+        生成写入结果表的各行：表头，及每位员工每个项目的基本信息、项目、当月汇总和逐日工时
+        """
+        if self.header is None:
+            return
+        yield self.header
+        totals, costs = self.totals, self.costs
+        for info, names, total_at, cost_at, days in self.staff:
+            width = len(names)
+            end = cost_at + width * days
+            info = list(info)
+            for pos, name in enumerate(names):
+                yield info + [name, totals[total_at + pos]] + costs[cost_at + pos:end:width].tolist()
+
+    def entries(self):
+        """
+        逐位员工产生 (基本信息, 项目名称, 各项目当月汇总, 按 日×项目 排列的工时, 天数)
+        """
+        totals, costs = self.totals, self.costs
+        for info, names, total_at, cost_at, days in self.staff:
+            yield info, names, totals[total_at:total_at + len(names)], costs[cost_at:cost_at + len(names) * days], days
+
+    def split(self):
+        """
+        按项目拆分，返回 {项目名称: 只包含该项目的MonthResult}，按项目首次出现的顺序排列
+        """
+        parts = {}
+        for info, names, total_at, cost_at, days in self.staff:
+            width = len(names)
+            end = cost_at + width * days
+            for pos, name in enumerate(names):
+                part = parts.get(name)
+                if part is None:
+                    part = parts[name] = MonthResult(self.header)
+                part.staff.append((info, (name,), len(part.totals), len(part.costs), days))
+                part.totals.append(self.totals[total_at + pos])
+                part.costs.extend(self.costs[cost_at + pos:end:width])
+        return parts
+
+    @staticmethod
+    def entry(info):
+        """
+        将time_analysis的分析结果转换为与entries相同的格式
+        """
+        return tuple(info[:6]), tuple(info[6]), info[7], [cost for time_cost in info[8:] for cost in time_cost], \
+            len(info) - 8
+
+    @staticmethod
+    def lines_of(records):
+        """
+        写入结果的各行，records为MonthResult或sheet_records产生的分析结果
+        """
+        return records.lines() if isinstance(records, MonthResult) else MonthResult.expand(records)
+
+    @staticmethod
+    def expand(records):
+        """
+        将sheet_records产生的分析结果逐行展开，用于流式写入
+        """
+        for i, rec in enumerate(records):
+            if i == 0:
+                yield rec
+            else:
+                for line in zip(*rec[6:]):
+                    yield rec[:6] + list(line)
+
+    def __eq__(self, other):
+        if not isinstance(other, MonthResult):
+            return NotImplemented
+        return (self.header == other.header and self.staff == other.staff and
+                self.totals == other.totals and self.costs == other.costs)
+
+
+class SqliteStore:
+    """
+    工时分配结果的SQLite存储，便于按项目、员工、月份快速查询
+    重新处理某月数据时，先删除该月的旧数据再写入，同一数据库可以累积多个月份及年份
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS months (
+            month TEXT PRIMARY KEY,     -- 月份，如 2021-01
+            source TEXT,                -- 来源工时数据表
+            sheet TEXT,                 -- 来源工作表
+            updated TEXT                -- 写入时间
+        );
+        CREATE TABLE IF NOT EXISTS employees (
+            month TEXT NOT NULL,
+            employee TEXT NOT NULL,     -- 工号
+            name TEXT,
+            dept1 TEXT, dept2 TEXT, dept3 TEXT, dept4 TEXT,
+            PRIMARY KEY (month, employee)
+        );
+        CREATE TABLE IF NOT EXISTS project_hours (
+            month TEXT NOT NULL,
+            employee TEXT NOT NULL,
+            project TEXT NOT NULL,
+            hours REAL NOT NULL         -- 当月汇总工时
+        );
+        CREATE TABLE IF NOT EXISTS allocations (
+            date TEXT NOT NULL,         -- 日期，如 2021-01-04
+            month TEXT NOT NULL,
+            employee TEXT NOT NULL,
+            project TEXT NOT NULL,
+            hours REAL NOT NULL         -- 当日分配的工时，只记录非0工时
+        );
+        CREATE INDEX IF NOT EXISTS idx_project_hours_project ON project_hours (project, month);
+        CREATE INDEX IF NOT EXISTS idx_project_hours_employee ON project_hours (employee, month);
+        CREATE INDEX IF NOT EXISTS idx_allocations_project ON allocations (project, month);
+        CREATE INDEX IF NOT EXISTS idx_allocations_employee ON allocations (employee, month);
+        CREATE INDEX IF NOT EXISTS idx_allocations_date ON allocations (date);
+    """
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size  # 每批写入的员工数
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def begin_month(self, yearname, sheet_name, source):
+        """
+        开始写入某月数据，删除该月的旧数据，在commit前不对其它连接可见
+        """
+        month = month_key(yearname, sheet_name)
+        self.conn.execute("BEGIN")
+        for table in ("employees", "project_hours", "allocations"):
+            self.conn.execute(f"DELETE FROM {table} WHERE month = ?", (month,))
+        self.conn.execute("INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)",
+                          (month, os.path.basename(source), sheet_name, time.strftime("%Y-%m-%d %H:%M:%S")))
+        return month
+
+    def insert(self, month, entries):
+        """
+        批量写入员工分析结果，entries格式见MonthResult.entries
+        """
+        employees, project_hours, allocations = [], [], []
+        for info, names, totals, costs, days in entries:
+            employees.append((month,) + tuple(info))
+            project_hours.extend((month, info[0], name, total) for name, total in zip(names, totals))
+            width = len(names)
+            for idx, cost in enumerate(costs):
+                if cost != 0:
+                    day, pos = divmod(idx, width)
+                    allocations.append((f"{month}-{day + 1:02d}", month, info[0], names[pos], cost))
+        self.conn.executemany("INSERT OR REPLACE INTO employees VALUES (?, ?, ?, ?, ?, ?, ?)", employees)
+        self.conn.executemany("INSERT INTO project_hours VALUES (?, ?, ?, ?)", project_hours)
+        self.conn.executemany("INSERT INTO allocations VALUES (?, ?, ?, ?, ?)", allocations)
+
+    def write_month(self, yearname, sheet_name, source, result):
+        """
+        写入某月的MonthResult，替换该月的旧数据
+        """
+        month = self.begin_month(yearname, sheet_name, source)
+        try:
+            entries = result.entries()
+            while True:
+                batch = [entry for _, entry in zip(range(self.batch_size), entries)]
+                if len(batch) <= 0:
+                    break
+                self.insert(month, batch)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def tap(self, yearname, sheet_name, source, records):
+        """
+        流式处理时使用：原样产生sheet_records的分析结果，同时分批写入数据库，全部产生后提交
+        """
+        month = self.begin_month(yearname, sheet_name, source)
+        try:
+            batch = []
+            for i, record in enumerate(records):
+                if i > 0:
+                    batch.append(MonthResult.entry(record))
+                    if len(batch) >= self.batch_size:
+                        self.insert(month, batch)
+                        batch = []
+                yield record
+            self.insert(month, batch)
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class Rollup:
+    """
+    工时汇总：在写入结果的同时累计 项目×月份、人员×月份 及 项目×人员 的工时，无需再次读取结果表
+    各项目当月汇总按分累加，汇总结果没有浮点累加误差
+    """
+
+    SHEETS = ("项目月度汇总", "人员月度汇总", "项目人员汇总")
+
+    def __init__(self):
+        self.months = set()
+        self.members = {}  # 工号 -> 员工基本信息
+        self.project_month = {}  # (项目, 月份) -> 工时（分）
+        self.member_month = {}  # (工号, 月份) -> 工时（分）
+        self.project_member = {}  # (项目, 工号) -> 工时（分）
+
+    def add(self, month, entries):
+        """
+        累计某月的员工分析结果，entries格式见MonthResult.entries
+        """
+        self.months.add(month)
+        project_month, member_month, project_member = self.project_month, self.member_month, self.project_member
+        for info, names, totals, _, _ in entries:
+            sid = info[0]
+            self.members[sid] = info
+            for name, total in zip(names, totals):
+                cents = round(total * 100)
+                project_month[name, month] = project_month.get((name, month), 0) + cents
+                member_month[sid, month] = member_month.get((sid, month), 0) + cents
+                project_member[name, sid] = project_member.get((name, sid), 0) + cents
+
+    def tap(self, month, records):
+        """
+        流式处理时使用：原样产生sheet_records的分析结果，同时累计汇总
+        """
+        for i, record in enumerate(records):
+            if i > 0:
+                self.add(month, [MonthResult.entry(record)])
+            yield record
+
+    def sheets(self):
+        """
+        :return: 各汇总工作表 [(标题, 各行数据)]
+        """
+        months = sorted(self.months)
+
+        projects = sorted({name for name, _ in self.project_month})
+        project_month = [["项目"] + months + ["合计"]] + [
+            [name] + [c / 100 for c in cents] + [sum(cents) / 100]
+            for name, cents in ((name, [self.project_month.get((name, month), 0) for month in months])
+                                for name in projects)]
+
+        member_month = [["工号", "姓名", "一级部门", "二级部门", "三级部门", "四级部门"] + months + ["合计"]] + [
+            list(self.members[sid]) + [c / 100 for c in cents] + [sum(cents) / 100]
+            for sid, cents in ((sid, [self.member_month.get((sid, month), 0) for month in months])
+                               for sid in sorted(self.members))]
+
+        project_member = [["项目", "工号", "姓名", "工时"]] + [
+            [name, sid, self.members[sid][1], self.project_member[name, sid] / 100]
+            for name, sid in sorted(self.project_member)]
+        return list(zip(self.SHEETS, (project_month, member_month, project_member)))
+
+    def write(self, out):
+        """
+        追加汇总工作表
+        :param out: 结果输出，见open_output
+        """
+        for title, rows in self.sheets():
+            out.add_sheet(title, rows)
+
+    def save(self, filename, output="xlsx"):
+        """
+        将汇总单独保存
+        :param output: 输出格式，见open_output
+        """
+        out = open_output(output, filename)
+        try:
+            self.write(out)
+            out.save()
+        finally:
+            out.close()
+
+
+class XlsxOutput:
+    """
+    xlsx结果表，每个月份一个工作表
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.wb = Workbook(write_only=True)
+        self.saved = False
+
+    def add_month(self, title, records):
+        DataProduct.write_sheet(self.wb.create_sheet(title=title), records)
+
+    def add_sheet(self, title, rows):
+        ws = self.wb.create_sheet(title=title)
+        for row in rows:
+            ws.append(row)
+
+    def save(self):
+        self.wb.save(self.path)
+        self.saved = True
+
+    def close(self):
+        if not self.saved:
+            # 未保存（处理取消或出错）时关闭各工作表的写入流，并删除openpyxl逐行写入使用的临时文件，
+            # 否则临时文件要到解释器退出时才删除，常驻服务及图形界面中会不断累积
+            for ws in self.wb.worksheets:
+                writer = ws._writer
+                if writer is None:
+                    continue
+                try:
+                    if ws._rows is not None:
+                        ws._rows.close()
+                    writer.close()
+                finally:
+                    writer.cleanup()
+        self.wb.close()
+
+
+class CsvOutput:
+    """
+    CSV结果目录，每个月份一个CSV文件，逐行写入，不占用额外内存
+    使用带BOM的UTF-8编码，Excel可直接打开
+    各文件先写入临时目录，保存时再替换结果目录，处理取消或出错时不留下不完整的结果
+    """
+
+    suffix = ".csv"
+
+    def __init__(self, path):
+        self.path = path
+        self.partial = f"{path}.partial"
+        # 清除上次中断时遗留的临时目录，保存时整个目录移入结果目录
+        shutil.rmtree(self.partial, ignore_errors=True)
+        os.makedirs(self.partial)
+
+    def add_month(self, title, records):
+        self.add_sheet(title, MonthResult.lines_of(records))
+
+    def add_sheet(self, title, rows):
+        name = f"{title}{self.suffix}"
+        with open(os.path.join(self.partial, name), "w", newline="", encoding="utf-8-sig") as f:
+            csv.writer(f).writerows(rows)
+
+    def save(self):
+        replace_dir(self.partial, self.path)
+
+    def close(self):
+        shutil.rmtree(self.partial, ignore_errors=True)
+
+
+class ParquetOutput(CsvOutput):
+    """
+    Parquet结果目录，每个月份一个Parquet文件，需要安装pyarrow
+    每个月份的数据在内存中转换为列后一次写入
+    """
+
+    suffix = ".parquet"
+    MISSING = "输出Parquet格式需要安装pyarrow：pip3 install pyarrow"
+
+    @staticmethod
+    def available():
+        # pyarrow为可选依赖，只在输出Parquet时才导入
+        return importlib.util.find_spec("pyarrow") is not None
+
+    def __init__(self, path):
+        if not self.available():
+            raise RuntimeError(self.MISSING)
+        import pyarrow
+        import pyarrow.parquet
+        self.pyarrow = pyarrow
+        super().__init__(path)
+
+    def add_sheet(self, title, rows):
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = []
+        for idx, name in enumerate(header):
+            name = f"列{idx + 1}" if name is None else str(name)
+            names.append(name if name not in names else f"{name}_{idx + 1}")
+
+        columns = [list(col) for col in zip(*rows)] or [[] for _ in names]
+        arrays = []
+        for col in columns:
+            try:
+                arrays.append(self.pyarrow.array(col))
+            except (self.pyarrow.ArrowInvalid, self.pyarrow.ArrowTypeError):
+                # 同一列中数字与文本混杂时统一转为文本
+                arrays.append(self.pyarrow.array([None if v is None else str(v) for v in col]))
+        table = self.pyarrow.Table.from_arrays(arrays, names=names[:len(arrays)])
+        name = f"{title}{self.suffix}"
+        self.pyarrow.parquet.write_table(table, os.path.join(self.partial, name))
+
+
+OUTPUTS = {"xlsx": XlsxOutput, "csv": CsvOutput, "parquet": ParquetOutput}
+
+
+def output_path(out_dir, prefix, filename, output):
+    """
+    结果的保存位置，xlsx为 前缀+原文件名，其它格式及分片输出为以 前缀+原文件名（不含扩展名）命名的目录
+    """
+    if output != "xlsx":
+        filename = os.path.splitext(filename)[0]
+    return os.path.join(out_dir or os.getcwd(), f"{prefix}{filename}")
+
+
+def open_output(output, path):
+    return OUTPUTS[output](path)
+
+
+def replace_dir(partial, path):
+    """
+    用写入完成的临时目录替换结果目录，上次处理遗留的文件（如月份或项目已减少）不再保留
+    """
+    if os.path.isdir(path):
+        stale = f"{path}.stale"
+        shutil.rmtree(stale, ignore_errors=True)
+        os.replace(path, stale)
+        shutil.rmtree(stale, ignore_errors=True)
+    os.replace(partial, path)
+
+
+class Validator:
+    """
+    数据校验：独立于工时分配逐行批量检查工时数据及项目成员信息表，问题按类别计数并保留有限的样例，
+    生成结构化的校验报告（JSON或xlsx），不再逐条输出警告
+    """
+
+    CATEGORIES = {
+        "bad_project_date": "项目起止时间错误",
+        "empty_row": "空行或数据不完整的行",
+        "unknown_employee": "员工不在项目成员信息表中",
+        "non_numeric": "工时不是数字",
+        "out_of_range": "工时超出0~24小时",
+        "beyond_month": "工时处于当月天数之外",
+        "gap_day": "工时处于项目空档期",
+    }
+    NUMERIC = (int, float, bool)
+    MAX_HOURS = 24
+    DAYS = 31  # 读取的日期列数，当月天数之外的列同样校验，更多的列视为表格之外的垃圾数据
+
+    def __init__(self, project=None, samples=20):
+        self.project = project  # ProjectMemenbers
+        self.samples_limit = samples  # 每类问题保留的样例数
+        self.counts = {category: 0 for category in self.CATEGORIES}
+        self.samples = {category: [] for category in self.CATEGORIES}
+        self.gaps = {}  # (年份, 月份, 项目名称元组) -> 项目空档期的日序号
+
+    def add(self, category, sample):
+        self.counts[category] += 1
+        if len(self.samples[category]) < self.samples_limit:
+            self.samples[category].append(sample)
+
+    def merge(self, other):
+        """
+        合并子进程中的校验结果
+        """
+        for category, count in other.counts.items():
+            self.counts[category] += count
+            self.samples[category].extend(other.samples[category][:self.samples_limit - len(self.samples[category])])
+
+    def check_projects(self):
+        """
+        检查已加载的项目成员信息中所有项目的起止时间是否为有效日期，格式及先后顺序已由valid_date检查
+        """
+        filename = os.path.basename(self.project.xlsx)
+        for name, project in self.project.projects.items():
+            try:
+                time.strptime(str(project['start']), "%Y-%m-%d")
+                time.strptime(str(project['end']), "%Y-%m-%d")
+            except ValueError:
+                self.add("bad_project_date", {"file": filename, "project": name, "start": project['start'],
+                                              "end": project['end'], "reason": "日期无效或时间格式不是YYYY-MM-DD"})
+
+    def tap(self, xlsx, yearname, sheet_name, rows):
+        """
+        逐批校验sheet_rows读取的数据行，校验后按当月天数截取再产生，校验不影响工时分配
+        :param rows: sheet_rows按DAYS读取的数据行，当月天数之外的日期列只用于校验
+        """
+        _, numbers = calendar.monthrange(int(yearname), int(sheet_name.replace("月", "")))
+        batch = []
+        header = False
+        for idx, row in enumerate(rows, 1):
+            if not header:
+                header = row[0] is not None and isinstance(row[0], str)
+                yield row[:numbers + 7]
+                continue
+            batch.append((idx, row))
+            if len(batch) >= 1000:
+                # 先校验再交给工时分配，分配过程出错时已读取的数据同样记入报告
+                self.check_rows(xlsx, yearname, sheet_name, batch)
+                yield from (row[:numbers + 7] for _, row in batch)
+                batch = []
+        self.check_rows(xlsx, yearname, sheet_name, batch)
+        yield from (row[:numbers + 7] for _, row in batch)
+
+    def check_rows(self, xlsx, yearname, sheet_name, batch):
+        """
+        批量校验某月的员工数据行
+        :param batch: [(行号, 数据行)]
+        """
+        month = "{0:>02s}".format(sheet_name.replace("月", ""))
+        _, numbers = calendar.monthrange(int(yearname), int(month))
+        filename = os.path.basename(xlsx)
+        members = self.project.members
+        numeric = self.NUMERIC
+        for idx, row in batch:
+            sid = row[0]
+            if sid is None or not isinstance(sid, str):
+                self.add("empty_row", {"file": filename, "sheet": sheet_name, "row": idx, "values": list(row[:7])})
+                continue
+            base = {"file": filename, "sheet": sheet_name, "row": idx, "employee": sid, "name": row[1]}
+            if sid not in members:
+                self.add("unknown_employee", base)
+                continue
+
+            costs = row[7:]
+            for day, cost in enumerate(costs):
+                if cost is None:
+                    continue
+                if day >= numbers:
+                    self.add("beyond_month", dict(base, date=f"{yearname}-{month}-{day + 1:02d}", value=cost))
+                elif type(cost) not in numeric:
+                    self.add("non_numeric", dict(base, date=f"{yearname}-{month}-{day + 1:02d}", value=str(cost)))
+                elif cost < 0 or cost > self.MAX_HOURS:
+                    self.add("out_of_range", dict(base, date=f"{yearname}-{month}-{day + 1:02d}", value=cost))
+
+            for day in self.gap_days(sid, yearname, month):
+                if day < min(numbers, len(costs)) and type(costs[day]) in numeric and int(costs[day]) != 0:
+                    self.add("gap_day", dict(base, date=f"{yearname}-{month}-{day + 1:02d}", value=costs[day]))
+
+    def gap_days(self, sid, year, month):
+        # 员工当月参与的项目均未开始或已结束的日期，参与相同项目组合的员工共用
+        names = tuple(name for name, _ in self.project.get_month_projects(sid, None, year, month))
+        key = (year, month, names)
+        days = self.gaps.get(key)
+        if days is None:
+            month_calendar = self.project.month_calendar(names, year, month)
+            days = tuple(day for day in range(0, 31) if month_calendar["{0:>02d}".format(day + 1)] is None)
+            self.gaps[key] = days
+        return days
+
+    def report(self):
+        return {"generated": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "counts": dict(self.counts),
+                "descriptions": dict(self.CATEGORIES),
+                "samples": {category: samples for category, samples in self.samples.items() if samples}}
+
+    def save(self, filename):
+        """
+        保存校验报告，扩展名为.xlsx时保存为工作簿，否则保存为JSON
+        """
+        if not filename.lower().endswith(".xlsx"):
+            with open(filename, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, ensure_ascii=False, indent=2, default=str)
+            return
+
+        out = XlsxOutput(filename)
+        try:
+            out.add_sheet("校验汇总", [["问题类别", "说明", "数量"]] +
+                          [[category, desc, self.counts[category]] for category, desc in self.CATEGORIES.items()])
+            for category, samples in self.samples.items():
+                if len(samples) <= 0:
+                    continue
+                keys = list(samples[0].keys())
+                out.add_sheet(self.CATEGORIES[category], [keys] + [
+                    [str(sample.get(key)) if isinstance(sample.get(key), list) else sample.get(key) for key in keys]
+                    for sample in samples])
+            out.save()
+        finally:
+            out.close()
+
+    def summary(self):
+        return "，".join(f"{desc}{self.counts[category]}处" for category, desc in self.CATEGORIES.items())
+
+    def warn(self, log):
+        """
+        输出保留的问题样例及汇总，开启checked时代替工时分配过程中的逐条警告
+        """
+        for category, samples in self.samples.items():
+            for sample in samples:
+                log.warn(f"{self.CATEGORIES[category]}：" + "，".join(f"{key}={value}" for key, value in sample.items()))
+        log.warn(f"数据校验：{self.summary()}")
+
+
+def _prefetch_rows(xlsx, reader, year, days):
+    """
+    读取工时数据表第一个月份的数据行，参数见Prefetch
+    :return: (工作表名称, 数据行)，年份或工作表名称有误时返回(None, None)，由open_workbook照常报告错误
+    """
+    try:
+        wb = load_xlsx(xlsx, reader)
+    except Exception:
+        return None, None
+    try:
+        sheet_name = wb.sheetnames[0]
+        yearname = DataProduct.year_of(xlsx, year)
+        return sheet_name, list(DataProduct.sheet_rows(wb[sheet_name], sheet_name, yearname, days))
+    except Exception:
+        return None, None
+    finally:
+        wb.close()
+
+
+class Prefetch:
+    """
+    预读工时数据表：解析项目成员信息表的同时读取第一个月份的数据行，项目成员信息就绪后即可开始分析。
+    两者均以Python代码解析XML，使用线程时争用GIL并不能同时进行，因此多核机器上在独立进程中读取，
+    数据行一次传回主进程；单核机器上不预读
+    """
+
+    @staticmethod
+    def available():
+        return (os.cpu_count() or 1) > 1
+
+    def __init__(self, xlsx, reader="auto", year=None, days=None, thread=False):
+        # days为读取的日期列数，见DataProduct.sheet_rows；thread为True时在线程中读取，用于基准测试对比
+        self.xlsx = xlsx
+        if thread:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=1, initializer=_init_worker)
+        self.task = self.executor.submit(_prefetch_rows, xlsx, reader, year, days)
+
+    def take_rows(self, sheet_name, progress=None):
+        """
+        取得预读的数据行，未预读该月份时返回None
+        :param progress: Progress，等待期间已取消时抛出Cancelled
+        """
+        if self.task is None:
+            return None
+        if progress is not None:
+            progress.wait(self.task, self.executor)
+        first, rows = self.task.result()
+        self.close()
+        return rows if first == sheet_name else None
+
+    def close(self):
+        # 未使用预读结果时（如项目成员信息表加载失败）不再等待
+        self.task = None
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DataProduct:
+    """
+    读取生产数据
+    """
+
+    def __init__(self, xlsx, project, log=None, checked=False, engine="python", jobs=1, reader="auto",
+                 cache=None, year=None, metrics=None, allocation="float", validator=None, progress=None):
+        self.xlsx = xlsx
+        self.data = {}
+        self.project = project
+        self.log = log
+        self.checked = checked
+        self.engine = engine  # 计算引擎：python 逐日计算，numpy 整月批量计算
+        self.jobs = jobs  # 并行处理的进程数，大于1时每个月份由独立进程处理
+        self.reader = reader  # 表格读取方式，见load_xlsx
+        self.cache = cache  # 分析结果缓存，为None时不使用缓存
+        self.year = year  # 工时数据所属年份，为None时从文件名中获取
+        self.metrics = metrics  # 运行统计，为None时不统计
+        self.validator = validator  # 数据校验，不为None时读取数据的同时批量校验，见Validator
+        self.allocation = allocation  # 工时分配方式：float 浮点逐项舍入，last/largest 整数分计算，见ProjectMemenbers.cents_of
+        self.progress = progress  # 处理进度及取消，为None时不统计进度，见Progress
+        self.prefetch = None  # 预读的第一个月份数据，见Prefetch
+
+    def time_analysis(self, year, month, record):
+        """
+        工时数据分析
+        """
+
+        # 1. 获取员工本月所参与的项目，根据项目权重计算工时比例，每个项目新增一行数据记录工时
+        record_projects = self.project.get_month_projects(record[0], record[1], year, month)
+        if record_projects is None:
+            return None
+        if self.allocation != "float":
+            return self.time_analysis_cents(year, month, record, record_projects)
+
+        info = record[:6]  # 员工基本信息
+        info.append([v[0] for v in record_projects])  # 当月参加项目列表, 此项为info[6]
+        info.append([c * 0.00 for c in range(0, len(record_projects))])  # 当月工时汇总, 此项为info[7]
+
+        for time_cost in self.day_costs(year, month, record, record_projects, self.project.scale_of):
+            info[7] = [round(i + j, 2) for i, j in zip(info[7], time_cost)]
+            # info[7] = numpy.array(copy.deepcopy(info[7])) + numpy.array(time_cost)
+            info.append(time_cost)
+        return info
+
+    def day_costs(self, year, month, record, record_projects, split):
+        """
+        逐日分配工时，从表格第7列（列表下标为6），也就是1日开始
+        工时及活动模式均与前一日相同时直接复用前一日的分配结果，其余日期由split计算
+        :param split: 分配方法 split(工时, 活动模式, 项目数)，见ProjectMemenbers.scale_of、cents_of
+        :return: 生成器，依次产生每日在各项目上分配的工时
+        """
+        memo = self.project.memo
+        width = len(record_projects)
+        last_cost, last_pattern, last = None, None, None
+        for idx in range(1, len(record[7:]) + 1):
+            cost = record[idx + 6]
+            pattern = self.project.day_active(cost, record_projects, year, month, "{0:>02d}".format(idx))
+            if pattern is not None and pattern is last_pattern and cost == last_cost:
+                memo.runs += 1
+                time_cost = list(last)
+            else:
+                time_cost = split(cost, pattern, width)
+                last_cost, last_pattern, last = cost, pattern, time_cost
+            yield time_cost
+
+    def time_analysis_cents(self, year, month, record, record_projects):
+        """
+        工时数据分析（整数分配），逐日按分计算及汇总，生成结果时才换算为小时，当月汇总不存在累加误差
+        """
+        largest = self.allocation == "largest"
+        totals = [0] * len(record_projects)
+        days = []
+        split = lambda cost, pattern, width: self.project.cents_of(cost, pattern, width, largest)
+        for time_cost in self.day_costs(year, month, record, record_projects, split):
+            totals = [i + j for i, j in zip(totals, time_cost)]
+            days.append(time_cost)
+
+        info = record[:6]  # 员工基本信息
+        info.append([v[0] for v in record_projects])  # 当月参加项目列表, 此项为info[6]
+        info.append([c / 100 for c in totals])  # 当月工时汇总, 此项为info[7]
+        info.extend([c / 100 for c in time_cost] for time_cost in days)
+        return info
+
+    @staticmethod
+    def valid_cost(cost):
+        """
+        与day_active相同的工时数据规则，返回可分配的工时，不可分配时返回0
+        """
+        if not isinstance(cost, (int, float)) or int(cost) == 0:
+            return 0.00
+        return cost
+
+    def time_analysis_batch(self, year, month, records):
+        """
+        工时数据批量分析（NumPy引擎），一次完成整月所有员工的工时分配，结果与time_analysis逐项一致
+        :return: 与records一一对应的分析结果，员工不在项目成员信息表中时为None
+        """
+        # 1. 获取员工本月所参与的项目，构建 员工×日 的工时矩阵
+        staff = []  # [员工下标, 项目名称元组]
+        days = max([len(record) - 7 for record in records] + [0])
+        costs = numpy.zeros((len(records), days))
+        for idx, record in enumerate(records):
+            record_projects = self.project.get_month_projects(record[0], record[1], year, month)
+            if record_projects is None:
+                continue
+            names = tuple(v[0] for v in record_projects)
+            for day, cost in enumerate(record[7:]):
+                costs[idx, day] = self.valid_cost(cost)
+            staff.append([idx, names])
+
+        results = [None] * len(records)
+        if len(staff) <= 0:
+            return results
+
+        # 2. 构建 员工×项目×日 的活动及权重张量，参与相同项目组合的员工共用日历
+        width = max([len(names) for _, names in staff] + [1])
+        combos = {}
+        for _, names in staff:
+            if names in combos:
+                continue
+            active = numpy.zeros((width, days), dtype=bool)
+            weight = numpy.zeros((width, days))
+            month_calendar = self.project.month_calendar(names, year, month)
+            for day in range(0, days):
+                pattern = month_calendar.get("{0:>02d}".format(day + 1))
+                if pattern is None:
+                    continue
+                positions, weights, _ = pattern
+                active[positions, day] = True
+                weight[positions, day] = weights
+            combos[names] = (len(combos), active, weight)
+        combo_ids = numpy.array([combos[names][0] for _, names in staff])
+        active = numpy.stack([v[1] for v in combos.values()])[combo_ids]
+        weight = numpy.stack([v[2] for v in combos.values()])[combo_ids]
+        cost = costs[[idx for idx, _ in staff]][:, numpy.newaxis, :]
+
+        # 3. 按权重分配工时，除最后一个项目外四舍五入保留两位小数，最后一个项目工时 = cost - 前面项目工时之和
+        sum_weight = weight.sum(axis=1, keepdims=True)
+        counts = active.sum(axis=1, keepdims=True)
+        if numpy.any((cost != 0) & (counts > 1) & (sum_weight == 0)):
+            raise ZeroDivisionError("division by zero")
+        last = numpy.zeros(active.shape, dtype=bool)
+        numpy.put_along_axis(last, width - 1 - numpy.argmax(active[:, ::-1, :], axis=1)[:, numpy.newaxis, :],
+                             True, axis=1)
+        last &= active
+        if self.allocation != "float":
+            alloc = self.split_cents_batch(cost, active, weight, last, counts)
+        else:
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                share = self.round_cost((weight / sum_weight) * cost, active & ~last & (cost != 0))
+            judge_value = numpy.cumsum(share, axis=1)[:, -1:, :]
+            remain = self.round_cost(cost - judge_value, (counts > 0) & (cost != 0))
+            alloc = numpy.where(last & (cost != 0), remain, share)
+
+        # 4. 汇总当月工时，逐日保留两位小数累加的结果等价于按分累加后换算
+        totals = numpy.rint(alloc * 100).sum(axis=2) / 100 + 0.00
+        for (idx, names), proj_alloc, proj_total in zip(staff, alloc, totals):
+            record = records[idx]
+            info = record[:6]  # 员工基本信息
+            info.append(list(names))  # 当月参加项目列表, 此项为info[6]
+            info.append(proj_total[:len(names)].tolist())  # 当月工时汇总, 此项为info[7]
+            info.extend(proj_alloc[:len(names), :len(record) - 7].T.tolist())
+            results[idx] = info
+        return results
+
+    def split_cents_batch(self, cost, active, weight, last, counts):
+        """
+        整数分配的批量计算，与split_cents逐项一致
+        :return: 员工×项目×日 的工时（单位：小时）
+        """
+        cents = numpy.rint(cost * 100).astype(numpy.int64) * (counts > 0)
+        weight = numpy.where(active, weight, 0).astype(numpy.int64)
+        sum_weight = weight.sum(axis=1, keepdims=True)
+        single = counts == 1
+        divisor = numpy.where(sum_weight == 0, 1, sum_weight)  # 单项目当日工时全部落入该项目，无需除法
+        if self.allocation == "largest":
+            quota, remain = numpy.divmod(cents * weight, divisor)
+            quota = numpy.where(active, quota, 0)
+            left = cents - quota.sum(axis=1, keepdims=True)
+            # 余数从大到小排序，余数相同时靠前的项目优先；非活动项目排在最后
+            order = numpy.argsort(numpy.where(active, -remain, 1), axis=1, kind="stable")
+            rank = numpy.argsort(order, axis=1, kind="stable")
+            shares = quota + (active & (rank < left))
+        else:
+            shares = numpy.where(active & ~last, (2 * cents * weight + divisor) // (2 * divisor), 0)
+            shares = numpy.where(last, cents - shares.sum(axis=1, keepdims=True), shares)
+        shares = numpy.where(single & active, cents, shares)
+        return shares / 100
+
+    @staticmethod
+    def round_cost(values, mask):
+        """
+        对mask选中的元素按round(x, 2)保留两位小数，其余元素置0
+        numpy.round对恰好处于进位边界附近的值与内置round可能不一致，这部分元素逐个使用内置round计算
+        """
+        values = numpy.where(mask, values, 0.00)
+        scaled = values * 100
+        result = numpy.rint(scaled) / 100
+        ties = numpy.abs(scaled - numpy.floor(scaled) - 0.5) < 1e-6
+        for pos in zip(*numpy.nonzero(ties)):
+            result[pos] = round(float(values[pos]), 2)
+        return result
+
+    @staticmethod
+    def sheet_rows(ws, sheet_name, yearname, days=None):
+        """
+        按当月天数截取数据列，逐行读取某月工时数据表
+        :param days: 读取的日期列数，为None时按当月天数，校验数据时见Validator.DAYS
+        """
+        month_num = sheet_name.replace("月", "")
+        # 计算某有多少天，用于统计列数，防止表格数据列之外存在垃圾数据读取。
+        _, numbers = calendar.monthrange(int(yearname), int(month_num))
+        if days is not None:
+            numbers = days
+        if ws.max_column is None:
+            # 部分工具生成的表格未记录数据范围，需遍历全表计算
+            ws.calculate_dimension(force=True)
+        # 两者取小的，假设某月并没有完成统计全部天数，或者表格存在垃圾列
+        max_column = min(numbers + 7, ws.max_column)
+        return ws.iter_rows(max_col=max_column, values_only=True)
+
+    def read_rows(self, ws, sheet_name, yearname):
+        """
+        逐行读取某月工时数据表，已预读的月份直接使用预读的数据行
+        校验数据时读取全部日期列，由Validator.tap按当月天数截取
+        """
+        rows = self.prefetch.take_rows(sheet_name, self.progress) if self.prefetch is not None else None
+        if rows is None:
+            rows = self.sheet_rows(ws, sheet_name, yearname, Validator.DAYS if self.validator is not None else None)
+        return rows
+
+    def sheet_records(self, rows, sheet_name, yearname, batch_size=None, stats=None):
+        """
+        逐行分析某月工时数据
+        :param rows: sheet_rows读取的工时数据行
+        :param batch_size: numpy引擎每批计算的员工数，为None时整月一次计算
+        :param stats: 本月的运行统计项，见RunMetrics.sheet
+        :return: 生成器，依次产生表头及每位员工的工时分析结果
+        """
+        if stats is not None:
+            yield from RunMetrics.count_records(self.sheet_records(rows, sheet_name, yearname, batch_size), stats)
+            return
+
+        month_num = sheet_name.replace("月", "")
+        month_num = "{0:>02s}".format(month_num)
+
+        self.log.info(f"读取{yearname}-{sheet_name}数据 ...")
+        r = 0
+        batch = []  # numpy引擎批量计算的员工数据
+        for row in rows:
+            record = list(row)
+            if record[0] is None or not isinstance(record[0], str) or len(record[0]) < 0:
+                continue
+            if r == 0:
+                record.insert(6, '项目')
+                yield record
+            elif self.engine == "numpy":
+                batch.append(record)
+                if batch_size is not None and len(batch) >= batch_size:
+                    yield from [rec for rec in self.time_analysis_batch(yearname, month_num, batch) if rec is not None]
+                    batch = []
+            else:
+                tmp_record = self.time_analysis(yearname, month_num, record)
+                if tmp_record is not None:
+                    yield tmp_record
+            r = r + 1
+        if len(batch) > 0:
+            yield from [rec for rec in self.time_analysis_batch(yearname, month_num, batch) if rec is not None]
+
+    def sheet_measure(self, yearname, sheet_name):
+        """
+        某月工时数据的运行统计，未开启统计时返回空的统计项
+        """
+        if self.metrics is None:
+            return contextlib.nullcontext(None)
+        return self.metrics.sheet(self.xlsx, yearname, sheet_name, self.project.memo)
+
+    def sheet_parser(self, ws, sheet_name, yearname):
+        """
+        读取并分析某月工时数据表
+        :return: MonthResult
+        """
+        with self.sheet_measure(yearname, sheet_name) as stats:
+            rows = self.read_rows(ws, sheet_name, yearname)
+            if stats is not None:
+                rows = RunMetrics.timed_rows(rows, stats)
+            if self.progress is not None:
+                rows = self.progress.tap(rows, self.xlsx, sheet_name)
+            if self.validator is not None:
+                rows = self.validator.tap(self.xlsx, yearname, sheet_name, rows)
+            if self.cache is None:
+                return MonthResult.collect(self.sheet_records(rows, sheet_name, yearname, stats=stats))
+
+            # 工作表数据及项目成员信息均未变化时，直接使用上次的分析结果
+            rows = list(rows)
+            key = self.cache.key("sheet", self.project.digest(), yearname, sheet_name, self.allocation, rows)
+            cached = self.cache.get(key)
+            if cached is not None:
+                records, logs = cached
+                for level, msg in logs:
+                    self.log.log(level, msg)
+                self.log.info(f"{yearname}-{sheet_name}数据未变化，使用缓存的分析结果。")
+                if stats is not None:
+                    stats["cached"] = True
+                    stats["employees"], stats["allocations"], stats["output_rows"] = records.summary()
+                return records
+
+            # 分析过程中的日志随结果一起缓存，使用缓存时同样输出
+            log, project_log = self.log, self.project.log
+            logs = LogBuffer(log)
+            self.log = self.project.log = logs
+            try:
+                records = MonthResult.collect(self.sheet_records(rows, sheet_name, yearname, stats=stats))
+            finally:
+                self.log, self.project.log = log, project_log
+            self.cache.put(key, (records, logs.records))
+            return records
+
+    def parallel_parser(self, sheets):
+        """
+        多进程读取分析工时数据表，每个进程处理一个月份，项目成员信息在进程启动时传入一次
+        :param sheets: [(工时数据表, 工作表名称, 年份)]，可以来自不同的工时数据表
+        :return: 按sheets顺序排列的各月分析结果
+        """
+        workers = min(self.jobs, len(sheets))
+        self.log.info(f"启用{workers}个进程并行处理{len(sheets)}个月份的工时数据 ...")
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sheet_worker,
+                                 initargs=(self.project.projects, self.project.members)) as executor:
+            options = {'checked': self.checked, 'engine': self.engine, 'reader': self.reader, 'cache': self.cache,
+                       'allocation': self.allocation, 'measure': self.metrics is not None,
+                       'validate': self.validator is not None}
+            tasks = [executor.submit(_sheet_worker, xlsx, sheet_name, yearname, options)
+                     for xlsx, sheet_name, yearname in sheets]
+            # 按月份顺序合并结果，子进程中的日志、运行统计及校验结果同样按顺序合并
+            for (xlsx, sheet_name, _), task in zip(sheets, tasks):
+                if self.progress is not None:
+                    self.progress.wait(task, executor)
+                    self.progress.finish(xlsx, sheet_name)
+                records, logs, stats, validator = task.result()
+                logs.replay(self.log)
+                if self.metrics is not None:
+                    self.metrics.sheets.extend(stats)
+                if self.validator is not None:
+                    self.validator.merge(validator)
+                results.append(records)
+        return results
+
+    @staticmethod
+    def year_of(xlsx, year=None):
+        """
+        工时数据所属年份，year为None时从文件名中获取
+        """
+        if year is not None:
+            return year
+        filename = os.path.basename(xlsx)
+        return filename.split("-")[1][:4] if "-" in filename else ""
+
+    def open_workbook(self):
+        """
+        校验并打开工时数据表
+        :return: (年份, 只读工作簿)，校验失败时返回(None, None)
+        """
+        yearname = self.year_of(self.xlsx, self.year)
+        if len(yearname) != 4 or not yearname.isdigit():
+            self.log.error(f"工时数据表[{self.xlsx}]文件名错误\n\t'文档名称-'后至少要有4位数字年份，如'产研平台工时数据-202101-08(XXX).xlsx'")
+            return None, None
+
+        if self.engine == "numpy" and numpy is None:
+            self.log.warn(f"未安装NumPy，使用python计算引擎处理工时数据。")
+            self.engine = "python"
+
+        wb = load_xlsx(self.xlsx, self.reader)
+        for sheet_name in wb.sheetnames:
+            if "月" not in sheet_name:
+                self.log.error(f"传入的工时数据表{self.xlsx}数据内容错误，请确认是否导入了正确的表？")
+                wb.close()
+                return None, None
+        return yearname, wb
+
+    def parser(self):
+        yearname, wb = self.open_workbook()
+        if wb is None:
+            return False
+
+        self.data[yearname] = {}
+        self.log.info(f"读取工时数据信息表数据 ...")
+        if self.progress is not None:
+            self.progress.expect(self.xlsx, wb, wb.sheetnames)
+        if self.jobs > 1 and len(wb.sheetnames) > 1:
+            sheetnames = wb.sheetnames
+            wb.close()
+            results = self.parallel_parser([(self.xlsx, sheet_name, yearname) for sheet_name in sheetnames])
+            month_data = dict(zip(sheetnames, results))
+        else:
+            month_data = {}
+            for sheet_name in wb.sheetnames:
+                month_data[sheet_name] = self.sheet_parser(wb[sheet_name], sheet_name, yearname)
+            wb.close()
+        self.log.info(f"工时数据信息表数据读取完成。")
+        self.data[yearname] = month_data
+        if self.cache is not None:
+            self.cache.evict()
+
+        return True
+
+    def merge(self, sources, window=None):
+        """
+        合并处理多个工时数据表，可以跨越多个年度，所有月份共用同一份项目成员信息及月度索引，
+        多进程处理时所有工作表由同一个进程池并行处理，结果按时间顺序保存，见writer的merged参数
+        :param sources: 工时数据表列表，同一月份出现在多个表中时使用靠后的表
+        :param window: (起始月份, 结束月份)，如 ((2021, 4), (2022, 3))，为None时处理全部月份
+        处理结果保存在data中，各月份所在的工时数据表保存在origins中
+        """
+        months = {}  # (年, 月) -> (工时数据表, 工作表名称, 年份)
+        productors = {}  # 工时数据表 -> 共用处理选项的DataProduct
+        for source in sources:
+            productor = productors[source] = copy.copy(self)
+            productor.xlsx = source
+            yearname, wb = productor.open_workbook()
+            if wb is None:
+                return False
+            for sheet_name in wb.sheetnames:
+                key = (int(yearname), int(sheet_name.replace("月", "")))
+                if window is not None and not window[0] <= key <= window[1]:
+                    continue
+                if key in months:
+                    self.log.warn(f"{yearname}-{sheet_name}同时出现在{months[key][0]}和{source}中，使用{source}中的数据。")
+                    if self.progress is not None:
+                        self.progress.forget(*months[key][:2])
+                months[key] = (source, sheet_name, yearname)
+            if self.progress is not None:
+                self.progress.expect(source, wb, [name for xlsx, name, _ in months.values() if xlsx == source])
+            wb.close()
+            self.engine = productor.engine  # 未安装NumPy时open_workbook会改用python计算引擎
+
+        sheets = [months[key] for key in sorted(months)]
+        self.log.info(f"合并处理{len(sources)}个工时数据表中的{len(sheets)}个月份 ...")
+        if self.jobs > 1 and len(sheets) > 1:
+            results = self.parallel_parser(sheets)
+        else:
+            # 逐个工时数据表读取，每个表只打开一次
+            parsed = {}
+            for source, productor in productors.items():
+                selected = [(sheet_name, yearname) for xlsx, sheet_name, yearname in sheets if xlsx == source]
+                if len(selected) <= 0:
+                    continue
+                wb = load_xlsx(source, self.reader)
+                try:
+                    for sheet_name, yearname in selected:
+                        parsed[source, sheet_name] = productor.sheet_parser(wb[sheet_name], sheet_name, yearname)
+                finally:
+                    wb.close()
+            results = [parsed[xlsx, sheet_name] for xlsx, sheet_name, _ in sheets]
+
+        self.data = {}
+        self.origins = {}
+        for (xlsx, sheet_name, yearname), records in zip(sheets, results):
+            self.data.setdefault(yearname, {})[sheet_name] = records
+            self.origins[yearname, sheet_name] = xlsx
+        self.log.info(f"工时数据信息表数据读取完成。")
+        if self.cache is not None:
+            self.cache.evict()
+        return True
+
+    @staticmethod
+    def write_sheet(ws, records):
+        """
+        将某月工时分析结果写入工作表，每位员工的每个项目展开为一行
+        :param records: MonthResult，或sheet_records产生的分析结果
+        """
+        for i, line in enumerate(MonthResult.lines_of(records)):
+            if i == 0:
+                # 设置列宽
+                for col_id in range(9, len(line) + 1):
+                    col_letter = get_column_letter(col_id)
+                    ws.column_dimensions[col_letter].width = 5
+            ws.append(line)
+
+    def writer(self, filename, rollup=None, rollup_sheets=True, output="xlsx", merged=False):
+        """
+        :param rollup: Rollup，不为None时同时累计工时汇总
+        :param rollup_sheets: 是否将汇总追加到结果中，为False时由调用者另行保存
+        :param output: 输出格式，见open_output
+        :param merged: 合并处理的结果，工作表以“年份-月份”命名，如“2021-1月”
+        """
+        self.log.info(f"正在处理工时数据 ...")
+        out = open_output(output, filename)
+        try:
+            for yearname, month_data in self.data.items():
+                for sheetname, records in month_data.items():
+                    if self.progress is not None:
+                        self.progress.check()
+                    out.add_month(f"{yearname}-{sheetname}" if merged else sheetname, records)
+                    if rollup is not None:
+                        rollup.add(month_key(yearname, sheetname), records.entries())
+            if rollup is not None and rollup_sheets:
+                rollup.write(out)
+            out.save()
+        finally:
+            out.close()
+
+        self.log.info(f"工时数据处理完成，生成新表：{filename} ...")
+        return True
+
+    def shard_writer(self, dirname, by="month", rollup=None, rollup_sheets=True, merged=False):
         """
-        :param sid: 员工工号
-        :param sid: 员工姓名
-        :param cost:  工时
-        :param record_projects:  本月参与的项目
-        :param year: 年份
-        :param month: 月份
-        :param date: 某日
-        :return: [ project_cost, project_cost2, project_cost3 ] 在每个项目上分配的工时
+        分片写入结果：每个月份或每个项目生成一个xlsx结果表，多进程处理时各分片由独立进程并行写入，
+        同时生成分片清单manifest.json，记录各分片包含的工作表、数据行数、文件大小及SHA-256校验值
+        分片先写入临时目录，全部完成后再替换结果目录
+        :param by: month 每个月份一个分片；project 每个项目一个分片，每个月份一个工作表
+        :param rollup: 工时汇总，rollup_sheets为True时作为单独的分片，见writer
         """
+        self.log.info(f"正在分片写入工时数据 ...")
+        months = []  # (工作表标题, MonthResult)
+        for yearname, month_data in self.data.items():
+            for sheetname, records in month_data.items():
+                months.append((f"{yearname}-{sheetname}" if merged else sheetname, records))
+                if rollup is not None:
+                    rollup.add(month_key(yearname, sheetname), records.entries())
 
-        # 当日未到岗，或者尚未加入项目，工时为0
-        if cost is None or int(cost) == 0:
-            return [c * 0.00 for c in range(0, len(record_projects))]
-
-        if not isinstance(cost, int) and not isinstance(cost, float):
-            if self.checked:
-                self.log.warn(f"员工 {sid}{sname} 在{year}-{month}-{date}工时数据{cost}必须为整形或浮点型！")
-            return [c * 0.00 for c in range(0, len(record_projects))]
-
-        # 判断某日是否有参与项目
-        sum_weight = 0  # 计算分母
-        work_projects = []  # 当日填写工时的项目清单, [项目名称,工时权重,分配工时值（保留小数点后两位）]
-        date_fmt = f"{year}-{month}-{date}"
-        for proj in record_projects:
-            if date_fmt < self.projects[proj[0]]['start'] or date_fmt > self.projects[proj[0]]['end']:
-                continue  # 当日未加入到项目工作，不分配工时
-            sum_weight = sum_weight + self.projects[proj[0]]['weight']
-            work_projects.append([proj[0], self.projects[proj[0]]['weight'], 0.00])
-
-        # 当日为项目空窗期，相当于当日没有任何项目可以落工时
-        if len(work_projects) <= 0:
-            if self.checked:
-                self.log.warn(f"员工 {sid}{sname} 在{year}-{month}-{date}处于项目空档期，工时无法落入项目！")
-            return [c * 0.00 for c in range(0, len(record_projects))]
+        shards = []  # (类型, 名称, [(工作表标题, MonthResult或各行数据)])
+        if by == "month":
+            shards.extend(("month", title, [(title, records)]) for title, records in months)
+        else:
+            projects = {}
+            for title, records in months:
+                for name, part in records.split().items():
+                    projects.setdefault(name, []).append((title, part))
+            shards.extend(("project", name, sheets) for name, sheets in projects.items())
+        if rollup is not None and rollup_sheets:
+            shards.append(("summary", "工时汇总", rollup.sheets()))
+
+        # 分片文件名去除文件系统不允许的字符，重名时追加序号
+        partial = f"{dirname}.partial"
+        shutil.rmtree(partial, ignore_errors=True)
+        os.makedirs(partial)
+        files = set()
+        tasks = []
+        for kind, name, sheets in shards:
+            base = re.sub(r'[\\/:*?"<>|\s]+', "_", str(name)).strip("._") or "_"
+            file, idx = f"{base}.xlsx", 1
+            while file.lower() in files:
+                idx += 1
+                file = f"{base}_{idx}.xlsx"
+            files.add(file.lower())
+            tasks.append((kind, name, os.path.join(partial, file), sheets))
 
-        # 计算分子（每个项目分配的工时时长，保留小数点后两位）
-        # judge_value 修正由于未除尽导致精度缺失，列表中最后一个项目工时 = cost - 前面项目工时之和
-        judge_value = 0.00
-        for project_idx, project_value in enumerate(work_projects):
-            if project_idx == len(work_projects) - 1:
-                project_value[2] = round(cost - judge_value, 2)
+        try:
+            entries = []
+            workers = min(self.jobs, len(tasks))
+            if workers > 1:
+                self.log.info(f"启用{workers}个进程并行写入{len(tasks)}个分片 ...")
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+                    futures = [executor.submit(_write_shard, path, sheets) for _, _, path, sheets in tasks]
+                    for future in futures:
+                        if self.progress is not None:
+                            self.progress.wait(future, executor)
+                        entries.append(future.result())
             else:
-                project_value[2] = round((project_value[1] / sum_weight) * cost, 2)
-                judge_value = judge_value + project_value[2]
+                for _, _, path, sheets in tasks:
+                    if self.progress is not None:
+                        self.progress.check()
+                    entries.append(_write_shard(path, sheets))
+            manifest = {"source": os.path.basename(self.xlsx), "shard": by, "shards": [
+                dict(type=kind, name=name, **entry) for (kind, name, _, _), entry in zip(tasks, entries)]}
+            with open(os.path.join(partial, "manifest.json"), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            replace_dir(partial, dirname)
+        finally:
+            shutil.rmtree(partial, ignore_errors=True)
 
-        # 返回所有需要记录项目当日的工时时值
-        # record_weight = []
-        tmpdict = {v[0]: v[2] for v in work_projects}
-        for rec in record_projects:
-            if rec[0] in tmpdict.keys():
-                rec[1] = tmpdict[rec[0]]
+        self.log.info(f"工时数据处理完成，生成{len(entries)}个分片：{dirname} ...")
+        return True
+
+    def stream(self, filename, batch_size=1000, store=None, rollup=None, rollup_sheets=True, output="xlsx"):
+        """
+        流式处理工时数据：逐行读取、分析后直接写入结果表，不在内存中保留各月数据
+        :param batch_size: numpy引擎每批计算的员工数
+        :param store: SqliteStore，不为None时同时写入数据库
+        :param rollup: Rollup，不为None时同时累计工时汇总，见writer
+        :param output: 输出格式，见open_output
+        """
+        yearname, wb = self.open_workbook()
+        if wb is None:
+            return False
+
+        self.log.info(f"正在流式处理工时数据 ...")
+        if self.progress is not None:
+            self.progress.expect(self.xlsx, wb, wb.sheetnames)
+        out = None
+        try:
+            out = open_output(output, filename)
+            for sheet_name in wb.sheetnames:
+                with self.sheet_measure(yearname, sheet_name) as stats:
+                    rows = self.read_rows(wb[sheet_name], sheet_name, yearname)
+                    if stats is not None:
+                        rows = RunMetrics.timed_rows(rows, stats)
+                    if self.progress is not None:
+                        rows = self.progress.tap(rows, self.xlsx, sheet_name)
+                    if self.validator is not None:
+                        rows = self.validator.tap(self.xlsx, yearname, sheet_name, rows)
+                    records = self.sheet_records(rows, sheet_name, yearname, batch_size, stats)
+                    if store is not None:
+                        records = store.tap(yearname, sheet_name, self.xlsx, records)
+                    if rollup is not None:
+                        records = rollup.tap(month_key(yearname, sheet_name), records)
+                    out.add_month(sheet_name, records)
+            if rollup is not None and rollup_sheets:
+                rollup.write(out)
+            out.save()
+        finally:
+            if out is not None:
+                out.close()
+            wb.close()
+
+        self.log.info(f"工时数据处理完成，生成新表：{filename} ...")
+        return True
+
+
+def _write_shard(path, sheets):
+    """
+    写入一个分片结果表，可在子进程中执行
+    :param sheets: [(工作表标题, MonthResult或各行数据)]
+    :return: 分片清单项，见DataProduct.shard_writer
+    """
+    out = XlsxOutput(path)
+    rows = 0
+    try:
+        for title, records in sheets:
+            if isinstance(records, MonthResult):
+                out.add_month(title, records)
+                rows += records.summary()[2]
             else:
-                rec[1] = 0.00
+                out.add_sheet(title, records)
+                rows += len(records) - 1
+        out.save()
+    finally:
+        out.close()
 
-        return [v[1] for v in record_projects]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {"file": os.path.basename(path), "sheets": [title for title, _ in sheets], "rows": rows,
+            "bytes": os.path.getsize(path), "sha256": digest.hexdigest()}
 
-    def get_month_projects(self, sid, sname, year, month):
-        if sid not in self.members.keys():
-            if self.checked:
-                self.log.warn(f"员工 {sid}{sname} 在项目成员信息表中未查询到相关记录！")
-            return None
 
-        record_projects = []
-        month_fmt = f"{year}-{month}"
-        for name in self.members[sid]:
-            # 当月任何一天在项目中记录了工时，那么全月该项目都要记录工时，如在8月31日时记录A项目工时
-            # 那么本月需要增加全月A项目的工时记录，除8月31日之外的日期记录为0，只是为了保持记录整齐
-            if self.projects[name]['start'][:7] <= month_fmt <= self.projects[name]['end'][:7]:
-                record_projects.append([name, 0])
+# 子进程中共享的项目成员信息，由进程池初始化时传入
+_worker_project = None
 
-        return record_projects
 
-    def print(self):
-        for k, v in self.members.items():
-            print(k, v)
+def _init_worker():
+    # 子进程忽略Ctrl+C，由主进程统一取消处理，见Progress
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-        for k, v in self.projects.items():
-            print(k, v)
 
-    def parser(self):
-        self.log.info(f"正在读取项目成员信息表[{self.xlsx}] ...")
-        wb = load_workbook(self.xlsx, read_only=True)
-        ws = wb.active
-        if ws.title != "项目及成员管理":
-            self.log.error(f"导入的的项目成员信息表{self.xlsx}数据内容错误，请确认是否导入了正确的表？")
-            return False
-        for row in ws.iter_rows(min_row=3):
-            # 如果项目没有成员，则忽略
-            if row[4].value is None:
-                continue
-            if not self.valid_parser(row):
-                return False
+def _init_sheet_worker(projects, members):
+    global _worker_project
+    _init_worker()
+    _worker_project = ProjectMemenbers(None)
+    _worker_project.projects = projects
+    _worker_project.members = members
 
-        self.log.info(f"项目成员信息数据读取成功。")
-        # self.print()
-        return True
 
+def _sheet_worker(xlsx, sheet_name, yearname, options):
+    """
+    子进程中处理某月工时数据表，日志、运行统计及校验结果缓存后随结果一起返回主进程
+    :param options: 处理选项，见DataProduct.parallel_parser
+    """
+    log = LogBuffer()
+    metrics = RunMetrics() if options['measure'] else None
+    validator = Validator(_worker_project) if options['validate'] else None
+    _worker_project.log = log
+    _worker_project.checked = options['checked']
+    wb = load_xlsx(xlsx, options['reader'])
+    try:
+        productor = DataProduct(xlsx, _worker_project, log, options['checked'], options['engine'],
+                                reader=options['reader'], cache=options['cache'], metrics=metrics,
+                                allocation=options['allocation'], validator=validator)
+        records = productor.sheet_parser(wb[sheet_name], sheet_name, yearname)
+        return records, log, metrics.sheets if metrics is not None else [], validator
+    finally:
+        wb.close()
 
-class DataProduct:
+
+class RunMetrics:
     """
-    读取生产数据
+    运行统计：记录各阶段及各月份的耗时、CPU时间、数据量和内存峰值，用于定位性能瓶颈
     """
 
-    def __init__(self, xlsx, project, log=None, checked=False):
-        self.xlsx = xlsx
-        self.data = {}
-        self.project = project
-        self.log = log
-        self.checked = checked
+    def __init__(self, log=None):
+        self.phases = []  # 各阶段统计，如项目成员信息表解析、工时数据解析、结果写入
+        self.sheets = []  # 各月份统计
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.logs = dict(getattr(log, "counts", {}))  # 开始时的各级别日志条数，同一日志对象多次处理时只统计本次的日志
+
+    @contextlib.contextmanager
+    def measure(self, stats, target):
+        # 统计代码块的耗时及CPU时间，结束后记入target
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield stats
+        finally:
+            stats["wall"] = round(time.perf_counter() - wall, 4)
+            stats["cpu"] = round(time.process_time() - cpu, 4)
+            if "read" in stats:
+                stats["read"] = round(stats["read"], 4)
+            target.append(stats)
 
-    def time_analysis(self, year, month, record):
+    def phase(self, name, xlsx=None):
         """
-        工时数据分析
+        统计某个处理阶段
         """
+        stats = {"name": name, "file": None if xlsx is None else os.path.basename(xlsx)}
+        return self.measure(stats, self.phases)
 
-        # 1. 获取员工本月所参与的项目，根据项目权重计算工时比例，每个项目新增一行数据记录工时
-        record_projects = self.project.get_month_projects(record[0], record[1], year, month)
-        if record_projects is None:
+    @contextlib.contextmanager
+    def sheet(self, xlsx, yearname, sheet_name, memo=None):
+        """
+        统计某月工时数据的处理，返回的统计项由timed_rows、count_records填充
+        :param memo: AllocationMemo，不为None时同时统计本月工时分配缓存的命中次数
+        """
+        stats = {"file": os.path.basename(xlsx), "sheet": f"{yearname}-{sheet_name}", "cached": False,
+                 "rows": 0, "read": 0.0, "employees": 0, "allocations": 0, "output_rows": 0,
+                 "memo_hits": 0, "memo_misses": 0, "memo_runs": 0}
+        start = memo.counts() if memo is not None else None
+        with self.measure(stats, self.sheets):
+            try:
+                yield stats
+            finally:
+                if memo is not None:
+                    stats.update((key, value - start[key]) for key, value in memo.counts().items())
+
+    @staticmethod
+    def timed_rows(rows, stats):
+        """
+        逐行读取并累计读取耗时，区分表格读取与工时分析各自的耗时
+        """
+        rows = iter(rows)
+        while True:
+            start = time.perf_counter()
+            try:
+                row = next(rows)
+            except StopIteration:
+                stats["read"] += time.perf_counter() - start
+                return
+            stats["read"] += time.perf_counter() - start
+            stats["rows"] += 1
+            yield row
+
+    @staticmethod
+    def count_records(records, stats):
+        """
+        统计分析结果中的员工数、按日分配工时的次数及展开后的输出行数
+        """
+        for i, rec in enumerate(records):
+            if i > 0:
+                stats["employees"] += 1
+                stats["allocations"] += len(rec) - 8
+                stats["output_rows"] += len(rec[6])
+            yield rec
+
+    @staticmethod
+    def peak_memory():
+        """
+        内存峰值（KB），包括已结束的子进程，无法统计时返回None
+        """
+        if resource is None:
             return None
+        peak = {"self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+        if sys.platform == "darwin":  # macOS下单位为字节
+            peak = {k: v // 1024 for k, v in peak.items()}
+        return peak
+
+    def totals(self):
+        totals = {key: sum(stats[key] for stats in self.sheets)
+                  for key in ("rows", "employees", "allocations", "output_rows", "memo_hits", "memo_misses",
+                              "memo_runs")}
+        lookups = totals["memo_hits"] + totals["memo_misses"] + totals["memo_runs"]
+        totals["memo_hit_ratio"] = round((totals["memo_hits"] + totals["memo_runs"]) / lookups, 4) if lookups else None
+        totals["read"] = round(sum(stats["read"] for stats in self.sheets), 4)
+        totals["sheets"] = len(self.sheets)
+        totals["cached"] = sum(1 for stats in self.sheets if stats["cached"])
+        return totals
+
+    def report(self, log=None):
+        """
+        汇总运行统计
+        :param log: 日志对象，用于统计本次处理各级别日志条数
+        """
+        logs = {level: count - self.logs.get(level, 0) for level, count in getattr(log, "counts", {}).items()
+                if count > self.logs.get(level, 0)}
+        return {"wall": round(time.perf_counter() - self.wall, 4),
+                "cpu": round(time.process_time() - self.cpu, 4),
+                "peak_rss_kb": self.peak_memory(),
+                "logs": logs,
+                "totals": self.totals(),
+                "phases": self.phases,
+                "sheets": self.sheets}
+
+    def summary(self, log):
+        """
+        在日志中输出运行统计摘要
+        """
+        report = self.report(log)
+        totals, logs, peak = report["totals"], report["logs"], report["peak_rss_kb"]
+        memory = "未知" if peak is None else f"{peak['self'] / 1024:.1f} MB（子进程 {peak['children'] / 1024:.1f} MB）"
+        lines = [f"运行统计：总耗时 {report['wall']:.2f} 秒，CPU {report['cpu']:.2f} 秒，内存峰值 {memory}"]
+        for stats in report["phases"]:
+            name = stats["name"] if stats["file"] is None else f"{stats['name']}[{stats['file']}]"
+            lines.append(f"  阶段 {name}: {stats['wall']:.2f} 秒，CPU {stats['cpu']:.2f} 秒")
+        for stats in report["sheets"]:
+            cached = "，使用缓存" if stats["cached"] else ""
+            lines.append(f"  月份 {stats['sheet']}: {stats['wall']:.2f} 秒（读取 {stats['read']:.2f} 秒），"
+                         f"CPU {stats['cpu']:.2f} 秒，读取 {stats['rows']} 行，员工 {stats['employees']} 人，"
+                         f"生成 {stats['output_rows']} 行{cached}")
+        lines.append(f"  合计：读取 {totals['rows']} 行，员工 {totals['employees']} 人，"
+                     f"按日分配工时 {totals['allocations']} 次，生成 {totals['output_rows']} 行，"
+                     f"警告 {logs.get('WARN', 0)} 条，错误 {logs.get('ERROR', 0)} 条")
+        if totals["memo_hit_ratio"] is not None:
+            lines.append(f"  工时分配缓存：命中 {totals['memo_hits']} 次，复用前一日 {totals['memo_runs']} 次，"
+                         f"计算 {totals['memo_misses']} 次，命中率 {totals['memo_hit_ratio']:.1%}")
+        log.info("\n".join(lines))
+
+    def save(self, filename, log=None):
+        """
+        将运行统计保存为JSON文件
+        """
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.report(log), f, ensure_ascii=False, indent=2)
 
-        info = record[:6]  # 员工基本信息
-        info.append([v[0] for v in record_projects])  # 当月参加项目列表, 此项为info[6]
-        info.append([c * 0.00 for c in range(0, len(record_projects))])  # 当月工时汇总, 此项为info[7]
 
-        for idx in range(1, len(record[7:]) + 1):
-            time_cost = self.project.get_time_scale(record[0], record[1],
-                                                    record[idx + 6],  # 从表格第7列（列表下标为6），也就是1日开始
-                                                    record_projects,
-                                                    year, month, "{0:>02d}".format(idx))  # 进行汇总
-            info[7] = [round(i + j, 2) for i, j in zip(info[7], time_cost)]
-            # info[7] = numpy.array(copy.deepcopy(info[7])) + numpy.array(time_cost)
-            info.append(time_cost)
-        return info
+class Cancelled(Exception):
+    """
+    处理已取消，见Progress.cancel
+    """
 
-    def parser(self):
-        filename = os.path.basename(self.xlsx)
-        yearname = filename.split("-")[1][:4]
-        if yearname != "2020" and yearname != "2021":
-            self.log.error(f"工时数据表[{self.xlsx}]文件名错误\n\t'文档名称-'后至少要有4位数字年份，如'产研平台工时数据-202101-08(XXX).xlsx'")
-            return False
 
-        self.data[yearname] = {}
-        wb = load_workbook(self.xlsx, read_only=True)
+class Progress:
+    """
+    处理进度及取消：按月份、按行统计进度，根据已处理的行数计算吞吐量及预计剩余时间
+    cancel可以在其它线程或信号处理函数中调用，处理流程每读取一批数据检查一次，已取消时抛出Cancelled，
+    尚未保存的结果随之丢弃
+    """
 
-        self.log.info(f"读取工时数据信息表数据 ...")
-        month_data = {}
-        for sheet_name in wb.sheetnames:
+    def __init__(self, callback=None, interval=2.0, batch_size=200):
+        self.callback = callback  # 进度回调callback(progress)，每隔interval秒及每个月份处理完成时调用
+        self.interval = interval
+        self.batch_size = batch_size  # 每读取多少行检查一次是否已取消
+        self.cancelled = threading.Event()
+        self.expected = {}  # 尚未完成的月份：(工时数据表, 工作表名称) -> 预计行数，无法预计时为None
+        self.total_rows = 0
+        self.rows = 0
+        self.sheets = 0
+        self.start = time.perf_counter()
+        self.reported = self.start
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise Cancelled("处理已取消")
+
+    def expect(self, xlsx, wb, sheet_names):
+        """
+        登记即将处理的月份，按工作表记录的数据范围估算行数；未记录数据范围时不为估算而遍历全表，
+        该月处理完成前不报告总行数及剩余时间
+        """
+        if self.rows == 0 and self.total_rows == 0:
+            # 从读取第一个工作表开始计算吞吐量，不计入项目成员信息表的加载时间
+            self.start = time.perf_counter()
+        for sheet_name in sheet_names:
             ws = wb[sheet_name]
-            if "月" not in sheet_name:
-                self.log.error(f"传入的工时数据表{self.xlsx}数据内容错误，请确认是否导入了正确的表？")
-                return False
-            month_num = sheet_name.replace("月", "")
-            month_num = "{0:>02s}".format(month_num)
-            month_data[sheet_name] = []
-
-            self.log.info(f"读取{yearname}-{sheet_name}数据 ...")
-            # 计算某有多少天，用于统计列数，防止表格数据列之外存在垃圾数据读取。
-            _, numbers = calendar.monthrange(int(yearname), int(month_num))
-            # 两者取小的，假设某月并没有完成统计全部天数，或者表格存在垃圾列
-            max_column = min(numbers + 7, ws.max_column)
-
-            r = 0
-            for row in ws.rows:
-                record = [row[c].value for c in range(0, max_column)]
-                if record[0] is None or not isinstance(record[0], str) or len(record[0]) < 0:
-                    if self.checked:
-                        self.log.warn(f"SheetName[{sheet_name}]存在空行[行号：{r + 1}]或者数据不完整的行\n{record}")
-                    continue
-                if r == 0:
-                    record.insert(6, '项目')
-                    month_data[sheet_name].append(record)
-                else:
-                    tmp_record = self.time_analysis(yearname, month_num, record)
-                    if tmp_record is not None:
-                        month_data[sheet_name].append(tmp_record)
-                r = r + 1
-        self.log.info(f"工时数据信息表数据读取完成。")
-        self.data[yearname] = month_data
-        wb.close()
+            if isinstance(ws, XlsxSheet):
+                dimension = ws.recorded_dimension()
+                rows = None if dimension is None else dimension[3]
+            else:
+                rows = ws.max_row  # openpyxl只读工作表同样只读取记录的数据范围
+            self.expected[xlsx, sheet_name] = rows
+            self.total_rows += rows or 0
 
-        return True
+    def forget(self, xlsx, sheet_name):
+        """
+        取消登记不再处理的月份
+        """
+        self.total_rows -= self.expected.pop((xlsx, sheet_name), 0) or 0
 
-    def writer(self, filename):
-        self.log.info(f"正在处理工时数据 ...")
-        wb = Workbook(write_only=True)
-        for month_data in self.data.values():
-            for sheetname, records in month_data.items():
-                ws = wb.create_sheet(title=sheetname)
-                # rows = len(records)
-                # columns = len(records[0])
-                for i, rec in enumerate(records):
-                    if i == 0:
-                        # 设置列宽
-                        for col_id in range(9, len(rec) + 1):
-                            col_letter = get_column_letter(col_id)
-                            ws.column_dimensions[col_letter].width = 5
-                        ws.append(rec)
-                    else:
-                        # ws.append(rec)
-                        revert_list = list(map(list, zip(*rec[6:])))
-                        for line in revert_list:
-                            ws.append(rec[:6] + line)
-                    # print(i, rec)
+    def tap(self, rows, xlsx, sheet_name):
+        """
+        原样产生工作表数据行并累计进度，每批数据之间检查是否已取消
+        """
+        count = 0
+        for row in rows:
+            if count % self.batch_size == 0:
+                self.check()
+                self.update()
+            count += 1
+            self.rows += 1
+            yield row
+        self.finish(xlsx, sheet_name, count)
+
+    def wait(self, task, executor):
+        """
+        多进程处理时等待某月的处理结果，等待期间已取消时不再启动排队中的月份
+        """
+        while not task.done():
+            if self.cancelled.is_set():
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.check()
+            wait([task], timeout=0.2)
 
-        wb.save(filename)
-        wb.close()
+    def finish(self, xlsx, sheet_name, rows=None):
+        """
+        某月处理完成
+        :param rows: 实际读取的行数，为None时（多进程处理）按预计行数计入进度
+        """
+        expected = self.expected.pop((xlsx, sheet_name), 0) or 0
+        if rows is None:
+            self.rows += expected
+        else:
+            self.total_rows += rows - expected
+        self.sheets += 1
+        self.update(force=True)
 
-        self.log.info(f"工时数据处理完成，生成新表：{filename} ...")
-        return True
+    def update(self, force=False):
+        now = time.perf_counter()
+        if self.callback is None or (not force and now - self.reported < self.interval):
+            return
+        self.reported = now
+        self.callback(self)
+
+    def snapshot(self):
+        """
+        当前进度：已完成及全部月份数、已读取及预计总行数、吞吐量（行/秒）、预计剩余秒数，无法估算的项为None
+        """
+        elapsed = time.perf_counter() - self.start
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        total_rows = None if None in self.expected.values() else self.total_rows
+        eta = max(total_rows - self.rows, 0) / rate if rate > 0 and total_rows else None
+        return {"sheets": self.sheets, "total_sheets": self.sheets + len(self.expected), "rows": self.rows,
+                "total_rows": total_rows, "rate": rate, "eta": eta}
+
+    def text(self):
+        state = self.snapshot()
+        text = f"进度：{state['sheets']}/{state['total_sheets']} 个月份，{state['rows']}"
+        text += " 行" if state["total_rows"] is None else f"/{state['total_rows']} 行"
+        if state["total_rows"]:
+            text += f"（{min(state['rows'] / state['total_rows'], 1.0):.0%}）"
+        text += f"，{state['rate']:.0f} 行/秒"
+        if state["eta"] is not None:
+            text += f"，预计剩余 {state['eta']:.0f} 秒"
+        return text
 
 
 class DataProcess:
@@ -302,35 +2441,453 @@ class DataProcess:
     后台程序独立统一入口
     """
 
-    def __init__(self, log, data_file, project_file):
+    def __init__(self, log, data_file, project_file, out_dir=None):
         self.log = log
-        self.data_file = data_file
+        self.data_file = data_file  # 工时数据表，批量处理时为文件列表
         self.project_file = project_file
+        self.out_dir = out_dir  # 结果输出目录，默认为当前目录
 
-    def run(self, checked=False):
+    def run(self, checked=False, engine="python", jobs=1, stream=False, reader="auto", cache_dir=None, year=None,
+            metrics_file=None, profile_file=None, allocation="float", database=None, summary=None, output="xlsx",
+            pminfo=None, validate_file=None, merge=None, window=None, progress=None, shard=None):
+        """
+        :param metrics_file: 运行统计JSON文件，为None时只在日志中输出统计摘要
+        :param profile_file: cProfile性能分析结果文件，为None时不开启性能分析，多进程处理时只分析主进程
+        :param allocation: 工时分配方式，float 与原有结果一致；last、largest 以整数分计算，各项目工时之和等于当日工时
+        :param database: SQLite数据库文件，不为None时工时分配结果同时写入数据库，重新处理的月份覆盖旧数据
+        :param summary: 工时汇总，sheets 追加到结果表，file 单独保存为TimeSummary_原文件名，为None时不汇总
+        :param output: 输出格式，xlsx 结果表；csv、parquet 以TimeResults_原文件名命名的目录，每个月份一个文件
+        :param pminfo: 已加载的项目成员信息，为None时解析project_file
+        :param validate_file: 校验报告文件（.json或.xlsx），不为None时单独批量校验数据并生成报告；
+                              开启checked时同样批量校验，问题样例及汇总输出到日志，工时分配过程中不再逐条校验
+        :param merge: 合并结果名称，不为None时所有工时数据表合并处理，生成一个TimeResults_合并结果名称
+        :param window: 合并处理的月份范围，见DataProduct.merge
+        :param progress: Progress，用于报告处理进度及取消处理，取消时丢弃未保存的结果并返回False
+        :param shard: 分片输出，month 每个月份、project 每个项目生成一个结果表，保存在TimeResults_原文件名目录中，
+                      并附带分片清单manifest.json，仅支持xlsx格式，为None时生成单个结果表
+        """
+        metrics = RunMetrics(self.log)
+        store = None
+        validator = None
+        prefetch = None
+        profiler = None
+        if profile_file is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
 
         try:
             self.log.info(f"\n**** 开始进行工时数据解析处理 ...")
+            # 处理前创建结果输出目录，避免处理完成后才在保存时出错
+            if self.out_dir is not None:
+                os.makedirs(self.out_dir, exist_ok=True)
+            if output == "parquet" and not ParquetOutput.available():
+                self.log.error(ParquetOutput.MISSING)
+                return False
+            if shard is not None and output != "xlsx":
+                self.log.error(f"分片输出仅支持xlsx格式。")
+                return False
 
-            # 解析项目成员信息表
-            pminfo = ProjectMemenbers(self.project_file, self.log, checked)
-            if not pminfo.parser():
-                return
+            # 解析项目成员信息表，批量处理时只解析一次
+            data_files = [self.data_file] if isinstance(self.data_file, str) else self.data_file
+            if pminfo is None:
+                # 同时预读第一个工时数据表的第一个月份，见Prefetch；多进程处理时各月份本就由子进程读取，
+                # 流式处理不在内存中保留整月数据，合并处理按时间顺序读取各表，均不预读
+                if merge is None and jobs <= 1 and (not stream or shard is not None) and len(data_files) > 0 \
+                        and Prefetch.available():
+                    days = Validator.DAYS if validate_file is not None or checked else None
+                    prefetch = Prefetch(data_files[0], reader, year, days)
+                with metrics.phase("project", self.project_file):
+                    pminfo = ProjectMemenbers(self.project_file, self.log, checked, reader)
+                    if not pminfo.load(cache_dir):
+                        return False
+            months = len(pminfo.month_spans)
+            if validate_file is not None or checked:
+                validator = Validator(pminfo)
+                with metrics.phase("validate", self.project_file):
+                    validator.check_projects()
+            if database is not None:
+                store = SqliteStore(database)
+
+            # 逐个解析处理工时信息表
+            options = {'checked': checked, 'engine': engine, 'jobs': jobs, 'reader': reader,
+                       'cache': ResultCache(cache_dir) if cache_dir else None, 'year': year, 'metrics': metrics,
+                       'allocation': allocation, 'validator': validator, 'progress': progress}
+            result = True
+            if merge is not None:
+                result = self.process_merged(merge, data_files, window, pminfo, stream, options, store, summary,
+                                             output, shard)
+            for data_file in data_files if merge is None else []:
+                # 单个工时数据表处理失败（如文件损坏）时记录错误，继续处理其余的表
+                try:
+                    if not self.process(data_file, pminfo, stream, options, store, summary, output, shard,
+                                        prefetch if data_file == data_files[0] else None):
+                        result = False
+                except Cancelled:
+                    raise
+                except Exception as e:
+                    self.log.error(f"工时数据表[{data_file}]处理失败：{type(e).__name__}: {e}")
+                    result = False
+
+            # 本次处理构建了新的月度索引时更新快照
+            if len(pminfo.month_spans) > months:
+                pminfo.save_snapshot()
+            return result
+
+        except Cancelled:
+            self.log.warn(f"处理已取消，未完成的结果已丢弃。")
+            return False
 
-            # 解析处理工时信息表
-            filename = os.path.basename(self.data_file)
-            outfile = os.path.join(os.getcwd(), f"TimeResults_{filename}")
-            productor = DataProduct(self.data_file, pminfo, self.log, checked)
+        except Exception as e:
+            self.log.error(str(e))
+            raise e
+
+        finally:
+            if prefetch is not None:
+                prefetch.close()
+            if store is not None:
+                store.close()
+            if validator is not None and validate_file is not None:
+                validator.save(validate_file)
+                self.log.info(f"数据校验：{validator.summary()}。校验报告已保存：{validate_file}")
+            elif validator is not None:
+                validator.warn(self.log)
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(profile_file)
+                self.log.info(f"性能分析结果已保存：{profile_file}，可使用 python -m pstats 查看。")
+            metrics.summary(self.log)
+            if metrics_file is not None:
+                metrics.save(metrics_file, self.log)
+                self.log.info(f"运行统计已保存：{metrics_file}")
+
+    def process(self, data_file, pminfo, stream, options, store=None, summary=None, output="xlsx", shard=None,
+                prefetch=None):
+        """
+        解析处理单个工时数据表，生成对应的结果表
+        :param store: SqliteStore，不为None时同时写入数据库
+        :param summary: 工时汇总方式，见run
+        :param output: 输出格式，见run
+        :param shard: 分片输出方式，见run
+        :param prefetch: 该工时数据表的Prefetch，为None时直接读取
+        """
+        filename = os.path.basename(data_file)
+        outfile = output_path(self.out_dir, "TimeResults_", filename, output if shard is None else "shard")
+        productor = DataProduct(data_file, pminfo, self.log, **options)
+        productor.prefetch = prefetch
+        metrics = options['metrics']
+        rollup = Rollup() if summary is not None else None
+        if stream and shard is not None:
+            self.log.warn(f"分片输出不支持流式处理，改为一次性读取全部数据。")
+        elif stream:
+            # 流式处理，读取、分析、写入同时进行，内存占用保持平稳
+            with metrics.phase("stream", data_file):
+                result = productor.stream(outfile, store=store, rollup=rollup, rollup_sheets=summary == "sheets",
+                                          output=output)
+            return result and self.save_summary(filename, rollup, summary, output)
+
+        with metrics.phase("parse", data_file):
             if not productor.parser():
-                return
+                return False
 
-            # 转换生成新的数据
-            if not productor.writer(outfile):
-                return
+        if store is not None:
+            with metrics.phase("database", data_file):
+                for yearname, month_data in productor.data.items():
+                    for sheet_name, result in month_data.items():
+                        store.write_month(yearname, sheet_name, data_file, result)
+            self.log.info(f"工时分配结果已写入数据库：{store.path}")
+
+        # 转换生成新的数据
+        with metrics.phase("write", data_file):
+            if shard is not None:
+                result = productor.shard_writer(outfile, shard, rollup, summary == "sheets")
+            else:
+                result = productor.writer(outfile, rollup, summary == "sheets", output)
+        return result and self.save_summary(filename, rollup, summary, output)
+
+    def process_merged(self, name, data_files, window, pminfo, stream, options, store=None, summary=None,
+                       output="xlsx", shard=None):
+        """
+        合并处理多个工时数据表，生成一个按时间顺序排列的结果表
+        :param name: 合并结果名称，结果表为TimeResults_合并结果名称
+        :param window: 月份范围，见DataProduct.merge
+        """
+        if stream:
+            self.log.warn(f"合并处理不支持流式处理，改为一次性读取全部数据。")
+        if not name.endswith(".xlsx"):
+            name += ".xlsx"
+        outfile = output_path(self.out_dir, "TimeResults_", name, output if shard is None else "shard")
+        productor = DataProduct(name, pminfo, self.log, **options)
+        metrics = options['metrics']
+        rollup = Rollup() if summary is not None else None
+        with metrics.phase("parse", name):
+            if not productor.merge(data_files, window):
+                return False
+
+        if store is not None:
+            with metrics.phase("database", name):
+                for yearname, month_data in productor.data.items():
+                    for sheet_name, result in month_data.items():
+                        store.write_month(yearname, sheet_name, productor.origins[yearname, sheet_name], result)
+            self.log.info(f"工时分配结果已写入数据库：{store.path}")
+
+        with metrics.phase("write", name):
+            if shard is not None:
+                result = productor.shard_writer(outfile, shard, rollup, summary == "sheets", merged=True)
+            else:
+                result = productor.writer(outfile, rollup, summary == "sheets", output, merged=True)
+        return result and self.save_summary(name, rollup, summary, output)
+
+    def save_summary(self, filename, rollup, summary, output="xlsx"):
+        """
+        工时汇总单独保存时，生成TimeSummary_原文件名
+        """
+        if summary != "file":
+            return True
+        outfile = output_path(self.out_dir, "TimeSummary_", filename, output)
+        rollup.save(outfile, output)
+        self.log.info(f"工时汇总已生成：{outfile}")
+        return True
+
+
+class WatchService:
+    """
+    常驻服务：项目成员信息表只加载一次，文件变化时自动重新加载
+    监视投递目录中新增或修改的工时数据表并自动处理，结果保存在工时数据表所在目录；
+    也可以通过本地HTTP接口提交任务、查询任务状态：
+        POST /jobs {"file": "工时数据表路径"}   提交任务
+        GET  /jobs                            查询所有任务
+        GET  /jobs/<任务编号>                   查询某个任务
+        GET  /status                          查询服务状态
+    """
+
+    def __init__(self, log, project_file, watch_dir=None, out_dir=None, interval=2.0, **options):
+        self.log = log
+        self.project_file = project_file
+        self.watch_dir = watch_dir  # 投递目录，为None时不监视
+        self.out_dir = out_dir  # 结果输出目录，为None时与工时数据表相同
+        self.interval = interval  # 轮询间隔（秒）
+        self.options = options  # 处理选项，见DataProcess.run
+        self.pminfo = None
+        self.project_stat = None  # 已加载的项目成员信息表的修改时间及大小
+        self.project_loaded = None
+        self.seen = {}  # 投递目录中已提交的文件 -> (修改时间, 大小)
+        self.pending = {}  # 可能仍在写入的文件 -> (修改时间, 大小)，两次轮询不变时才提交
+        self.jobs = {}  # 任务编号 -> 任务状态
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.server = None
+
+    def reload_project(self):
+        """
+        项目成员信息表变化时重新加载，加载失败时继续使用之前的项目成员信息
+        :return: 是否有可用的项目成员信息
+        """
+        try:
+            stat = os.stat(self.project_file)
+        except OSError as e:
+            self.log.error(f"无法读取项目成员信息表：{e}")
+            return self.pminfo is not None
+        if (stat.st_mtime_ns, stat.st_size) == self.project_stat:
+            return True
+
+        self.log.info(f"加载项目成员信息表：{self.project_file}")
+        pminfo = ProjectMemenbers(self.project_file, self.log, self.options.get("checked", False),
+                                  self.options.get("reader", "auto"))
+        if not pminfo.load(self.options.get("cache_dir")):
+            self.log.error(f"项目成员信息表加载失败，{'继续使用之前的项目成员信息' if self.pminfo else '等待文件更新'}。")
+            self.project_stat = (stat.st_mtime_ns, stat.st_size)
+            return self.pminfo is not None
+        self.pminfo = pminfo
+        self.project_stat = (stat.st_mtime_ns, stat.st_size)
+        self.project_loaded = time.strftime("%Y-%m-%d %H:%M:%S")
+        return True
+
+    def submit(self, data_file):
+        """
+        提交工时数据表处理任务
+        :return: 任务状态
+        """
+        with self.lock:
+            job = {"id": str(len(self.jobs) + 1), "file": os.path.abspath(data_file), "status": "queued",
+                   "submitted": time.strftime("%Y-%m-%d %H:%M:%S"), "started": None, "finished": None,
+                   "seconds": None, "error": None, "reports": {}}
+            self.jobs[job["id"]] = job
+        self.queue.put(job)
+        self.log.info(f"任务{job['id']}已提交：{job['file']}")
+        return dict(job)
+
+    def status(self, job_id=None):
+        with self.lock:
+            if job_id is not None:
+                job = self.jobs.get(job_id)
+                return None if job is None else dict(job)
+            return [dict(job) for job in self.jobs.values()]
+
+    def is_current(self, data_file, stat):
+        # 结果表比工时数据表新时无需重新处理，如服务重启后目录中已处理过的文件
+        out_dir = self.out_dir or os.path.dirname(data_file)
+        output = self.options.get("output", "xlsx") if self.options.get("shard") is None else "shard"
+        outfile = output_path(out_dir, "TimeResults_", os.path.basename(data_file), output)
+        return os.path.exists(outfile) and os.stat(outfile).st_mtime_ns >= stat.st_mtime_ns
+
+    def scan(self):
+        """
+        检查投递目录中新增或修改的工时数据表
+        """
+        for data_file in find_data_files([self.watch_dir], self.project_file) or []:
+            try:
+                stat = os.stat(data_file)
+            except OSError:
+                continue
+            key = (stat.st_mtime_ns, stat.st_size)
+            if self.seen.get(data_file) == key:
+                continue
+            if self.pending.get(data_file) != key:
+                # 文件可能仍在复制中，下次轮询修改时间及大小不变时再处理
+                self.pending[data_file] = key
+                continue
+            del self.pending[data_file]
+            self.seen[data_file] = key
+            if not self.is_current(data_file, stat):
+                self.submit(data_file)
+
+    def work(self):
+        """
+        后台线程依次处理任务，空闲时检查项目成员信息表是否变化
+        """
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.get(timeout=self.interval)
+            except queue.Empty:
+                self.reload_project()
+                continue
+            self.run_job(job)
+
+    # 每个任务单独生成的报告文件，见DataProcess.run
+    REPORTS = ("metrics_file", "validate_file", "profile_file")
 
+    def job_options(self, job):
+        """
+        某个任务的处理选项：运行统计、校验报告及性能分析文件按任务编号及工时数据表名称区分，
+        如 metrics.json -> metrics_3_工时数据-2021.json，避免后续任务覆盖之前的报告
+        """
+        options = dict(self.options)
+        stem = os.path.splitext(os.path.basename(job["file"]))[0]
+        reports = {}
+        for key in self.REPORTS:
+            if options.get(key) is not None:
+                base, ext = os.path.splitext(options[key])
+                options[key] = reports[key] = f"{base}_{job['id']}_{stem}{ext}"
+        with self.lock:
+            job["reports"] = reports
+        return options
+
+    def run_job(self, job):
+        with self.lock:
+            job["status"] = "running"
+            job["started"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        start = time.perf_counter()
+        try:
+            if not self.reload_project():
+                raise RuntimeError("项目成员信息表不可用")
+            out_dir = self.out_dir or os.path.dirname(job["file"])
+            options = self.job_options(job)
+            result = DataProcess(self.log, job["file"], self.project_file, out_dir).run(pminfo=self.pminfo,
+                                                                                       **options)
+            status, error = ("done", None) if result else ("failed", "处理失败，详见日志")
         except Exception as e:
-            self.log.error(str(e))
-            raise e
+            status, error = "failed", str(e)
+        with self.lock:
+            job["status"] = status
+            job["error"] = error
+            job["finished"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            job["seconds"] = round(time.perf_counter() - start, 3)
+        self.log.info(f"任务{job['id']}{'处理完成' if status == 'done' else '处理失败'}，"
+                      f"耗时{job['seconds']}秒：{job['file']}")
+
+    def serve(self, port=None):
+        """
+        启动服务，直到收到中断信号
+        :param port: 本地HTTP接口端口，为None时不启动HTTP接口
+        """
+        if not self.reload_project():
+            return False
+        worker = threading.Thread(target=self.work, daemon=True)
+        worker.start()
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), JobRequestHandler)
+            self.server.service = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            self.log.info(f"HTTP接口已启动：http://127.0.0.1:{self.server.server_address[1]}/jobs")
+        if self.watch_dir is not None:
+            self.log.info(f"正在监视投递目录：{self.watch_dir}")
+
+        try:
+            while not self.stopped.is_set():
+                if self.watch_dir is not None:
+                    self.scan()
+                self.stopped.wait(self.interval)
+        except KeyboardInterrupt:
+            self.log.info(f"服务已停止。")
+        finally:
+            self.stop()
+        return True
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    WatchService的HTTP接口
+    """
+
+    def reply(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        parts = [part for part in self.path.split("?")[0].split("/") if part]
+        if parts == ["status"]:
+            self.reply(200, {"project_file": service.project_file, "project_loaded": service.project_loaded,
+                             "watch_dir": service.watch_dir, "queued": service.queue.qsize(),
+                             "jobs": len(service.jobs)})
+        elif parts == ["jobs"]:
+            self.reply(200, service.status())
+        elif len(parts) == 2 and parts[0] == "jobs" and service.status(parts[1]) is not None:
+            self.reply(200, service.status(parts[1]))
+        else:
+            self.reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path.split("?")[0].rstrip("/") != "/jobs":
+            self.reply(404, {"error": "not found"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            data_file = body["file"]
+        except (ValueError, KeyError, TypeError):
+            self.reply(400, {"error": "请求格式为 {\"file\": \"工时数据表路径\"}"})
+            return
+        if not os.path.isfile(data_file):
+            self.reply(404, {"error": f"找不到工时数据表文件: {data_file}"})
+            return
+        self.reply(202, service.submit(data_file))
+
+    def log_message(self, format, *args):
+        # 不输出访问日志
+        pass
 
 
 class LogTrace:
@@ -338,32 +2895,39 @@ class LogTrace:
     日志打印
     """
 
+    REPEAT_LIMIT = 3  # 界面上同类警告最多显示的条数，其余只计数
+    WARN_LIMIT = 500  # 界面上警告最多显示的条数
+
     def __init__(self):
         self.log_gui = None
         self.log_file = None
         self.inf = None
+        self.counts = {}  # 各级别日志条数
+        self.queue = None  # 界面日志队列，处理线程写入，由界面定时批量显示
+        self.repeats = {}  # 界面上同类警告的首条内容及条数
+        self.shown = 0  # 界面上已显示的警告条数
 
     def init_log(self, log_gui=None, log_file=None):
         self.log_gui = log_gui
         self.log_file = log_file
+        if self.log_gui is not None and self.queue is None:
+            self.queue = queue.Queue()
         if self.log_file is not None:
-            self.inf = open(self.log_file, 'a+')
+            self.inf = open(self.log_file, 'a+', buffering=1)  # 按行写入，常驻服务模式下日志及时落盘
 
     def log(self, level, msg):
+        self.counts[level] = self.counts.get(level, 0) + 1
         if self.log_gui is not None:
-            self.log_gui.config(state=tk.NORMAL)
-            self.log_gui.see(tk.END)
-
-            if level == "ERROR":
-                self.log_gui.insert(tk.INSERT, f"[{level}] {msg}\n")
-            elif level == "WARN":
-                self.log_gui.insert(tk.INSERT, f"[{level}] {msg}\n")
+            # 不在处理线程中直接操作界面，大量警告时只显示前几条同类警告
+            if level == "WARN":
+                key = re.sub(r"\d+", "#", msg)  # 忽略日期、行号等数字的差异
+                repeat = self.repeats.setdefault(key, [msg, 0])
+                repeat[1] += 1
+                if repeat[1] <= self.REPEAT_LIMIT and self.shown < self.WARN_LIMIT:
+                    self.shown += 1
+                    self.queue.put(f"[{level}] {msg}\n")
             else:
-                self.log_gui.insert(tk.INSERT, f"[{level}] {msg}\n")
-            self.log_gui.update()
-
-            self.log_gui.see(tk.END)
-            self.log_gui.config(state=tk.DISABLED)
+                self.queue.put(f"[{level}] {msg}\n")
 
         if self.inf is not None:
             self.inf.write(f"[{level}] {msg}\n")
@@ -371,6 +2935,30 @@ class LogTrace:
         # if self.log_gui is None and self.log_file is None:
         print(f"[{level}] {msg}")
 
+    def flush_repeats(self):
+        """
+        在界面上汇总显示被省略的警告条数
+        """
+        total = sum(count for _, count in self.repeats.values())
+        if total > self.shown:
+            summary = [f"[WARN] 共{total}条警告，界面上省略{total - self.shown}条，完整内容见控制台输出。同类警告统计："]
+            summary.extend(f"\t{count}条：{msg}" for msg, count in self.repeats.values() if count > self.REPEAT_LIMIT)
+            self.queue.put("\n".join(summary[:self.WARN_LIMIT]) + "\n")
+        self.repeats = {}
+        self.shown = 0
+
+    def drain(self, limit=1000):
+        """
+        取出界面日志队列中的日志，每次最多limit条
+        """
+        lines = []
+        try:
+            while len(lines) < limit:
+                lines.append(self.queue.get_nowait())
+        except queue.Empty:
+            pass
+        return lines
+
     def info(self, msg):
         self.log("INFO", msg)
 
@@ -381,6 +2969,26 @@ class LogTrace:
         self.log("ERROR", msg)
 
 
+class LogBuffer(LogTrace):
+    """
+    日志缓存，用于子进程记录日志，由主进程按顺序回放
+    """
+
+    def __init__(self, forward=None):
+        super().__init__()
+        self.records = []
+        self.forward = forward  # 同时输出日志的目标
+
+    def log(self, level, msg):
+        self.records.append((level, msg))
+        if self.forward is not None:
+            self.forward.log(level, msg)
+
+    def replay(self, log):
+        for level, msg in self.records:
+            log.log(level, msg)
+
+
 class EasyGui:
     """
     简易操作界面
@@ -394,7 +3002,13 @@ class EasyGui:
         self.data_file = ""
         self.project_file = ""
         self.check_option = False  # 默认不开启数据检验
+        self.parallel_option = False  # 默认不开启多进程处理
         self.log = LogTrace()  # 处理信息文本输出框
+        self.worker = None  # 后台处理线程
+        self.button = None  # 处理中禁用的执行按钮
+        self.progress = None  # 处理进度，处理中可以取消
+        self.progress_text = None  # 进度显示
+        _import_tkinter()
 
     def use_help(self):
         self.scroll.config(state=tk.NORMAL)
@@ -437,25 +3051,58 @@ class EasyGui:
         if len(self.project_file) <= 0:
             self.log.error(f'您还未导入项目成员信息表.')
             return
+        if self.worker is not None and self.worker.is_alive():
+            return
 
+        # 禁用处理按钮，避免重复进入，处理结束后由show_log恢复
+        btn.config(state='disabled')
+        self.button = btn
+
+        # 在后台线程中处理，界面保持响应
+        jobs = (os.cpu_count() or 1) if self.parallel_option else 1
+        self.progress = Progress()
+        self.worker = threading.Thread(target=self.run_task,
+                                       args=(self.data_file, self.project_file, self.check_option, jobs,
+                                             self.progress),
+                                       daemon=True)
+        self.worker.start()
+
+    def cancel(self):
+        if self.worker is not None and self.worker.is_alive():
+            self.progress.cancel()
+            self.progress_text.set("正在取消 ...")
+
+    def run_task(self, data_file, project_file, checked, jobs, progress):
         try:
-            # 初始化日志处理对象
-            self.log.init_log(self.scroll, None)
-
-            # 禁用处理按钮，避免重复进入
-            btn.config(state='disabled')
-
-            DataProcess(self.log,
-                        self.data_file,
-                        self.project_file).run(self.check_option)
-        except Exception:
-            raise
+            DataProcess(self.log, data_file, project_file).run(checked, jobs=jobs, progress=progress)
         finally:
-            btn.config(state='normal')
+            self.log.flush_repeats()
+
+    def show_log(self):
+        """
+        定时将处理线程产生的日志批量显示到文本框
+        """
+        lines = self.log.drain()
+        if len(lines) > 0:
+            self.scroll.config(state=tk.NORMAL)
+            self.scroll.insert(tk.END, "".join(lines))
+            self.scroll.see(tk.END)
+            self.scroll.config(state=tk.DISABLED)
+
+        if self.button is not None and self.worker.is_alive() and not self.progress.cancelled.is_set():
+            self.progress_text.set(self.progress.text())
+        if self.button is not None and not self.worker.is_alive() and self.log.queue.empty():
+            self.button.config(state='normal')
+            self.button = None
+            self.progress_text.set("已取消" if self.progress.cancelled.is_set() else self.progress.text())
+        self.win.after(10 if len(lines) > 0 else 100, self.show_log)
 
     def check_selection(self, checkval):
         self.check_option = checkval.get()
 
+    def parallel_selection(self, parallelval):
+        self.parallel_option = parallelval.get()
+
     def openfile(self, snames, opt):
         file_name = askopenfilename(title='选择Excel文件',
                                     initialdir=os.getcwd(),
@@ -495,10 +3142,19 @@ class EasyGui:
         checkvar = tk.BooleanVar()
         tk.Checkbutton(frm, text='开启数据检查', variable=checkvar, onvalue=True, offvalue=False,
                        command=lambda: self.check_selection(checkvar)).grid(row=2, column=1, sticky=tk.W)
+        parallelvar = tk.BooleanVar()
+        tk.Checkbutton(frm, text='多进程处理', variable=parallelvar, onvalue=True, offvalue=False,
+                       command=lambda: self.parallel_selection(parallelvar)).grid(row=2, column=1, sticky=tk.W,
+                                                                                  padx=(120, 0))
         tk.Button(frm, text='帮助', width=10, command=self.use_help).grid(row=2, column=1, sticky=tk.E)
         btn = tk.Button(frm, text='执行', width=10, command=lambda: self.process(btn))
         btn.grid(row=2, column=2, pady=5, sticky=tk.W)
 
+        # 处理进度，处理中可以取消
+        self.progress_text = tk.StringVar()
+        tk.Label(frm, textvariable=self.progress_text, font=("宋体", 11)).grid(row=3, column=1, sticky=tk.W)
+        tk.Button(frm, text='取消', width=10, command=self.cancel).grid(row=3, column=2, sticky=tk.W)
+
     def text_dialog(self, frm, frm_width, frm_height):
         self.scroll = ScrolledText(frm, width=frm_width, height=frm_height, wrap=tk.WORD,state=tk.DISABLED )
         self.scroll.pack(fill=tk.X, ipady=2, expand=False)
@@ -542,6 +3198,9 @@ class EasyGui:
         self.text_dialog(frm2, frm2.winfo_width(), frm2.winfo_height())
         win.update()
 
+        self.win = win
+        win.after(100, self.show_log)
+
         win.mainloop()
 
 
@@ -549,36 +3208,140 @@ def app_main():
     EasyGui().application()
 
 
+def find_data_files(paths, project_file):
+    """
+    展开命令行传入的工时数据表，支持文件、目录及通配符
+    目录及通配符中的结果表、Excel临时文件和项目成员信息表会被忽略
+    """
+    data_files = []
+    for path in paths:
+        if os.path.isfile(path):
+            if path not in data_files:
+                data_files.append(path)
+            continue
+
+        if os.path.isdir(path):
+            candidates = sorted(glob.glob(os.path.join(path, "*.xlsx")))
+        elif any(c in path for c in "*?["):
+            candidates = sorted(glob.glob(path))
+        else:
+            print(f"找不到工时数据表文件: {path}")
+            return None
+
+        for name in candidates:
+            basename = os.path.basename(name)
+            if basename.startswith(("TimeResults_", "TimeSummary_", "~$")):
+                continue
+            if os.path.abspath(name) == os.path.abspath(project_file):
+                continue
+            if name not in data_files:
+                data_files.append(name)
+    return data_files
+
+
+def parse_window(text):
+    """
+    解析月份范围，如 2021-04:2022-03，格式错误时返回None
+    """
+    match = re.fullmatch(r"\s*(\d{4})-(\d{1,2})\s*:\s*(\d{4})-(\d{1,2})\s*", text)
+    if match is None:
+        return None
+    start, end = (int(match[1]), int(match[2])), (int(match[3]), int(match[4]))
+    if not 1 <= start[1] <= 12 or not 1 <= end[1] <= 12 or start > end:
+        return None
+    return start, end
+
+
 def cmd_main(argv):
-    if len(argv) <= 3:
-        print(f" ERR: 命令参数错误。")
-        print(f" 示例: {argv[0]} <工时数据信息表.xlsx> <项目成员信息表.xlsx> [True|False]")
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="快乐工时：按项目成员信息表批量转换工时数据表，无需图形界面。")
+    parser.add_argument("data", nargs="*", help="工时数据信息表，可以是多个文件、目录或通配符，如 data/*.xlsx")
+    parser.add_argument("-p", "--project", required=True, help="项目成员信息表")
+    parser.add_argument("-o", "--out-dir", default=None, help="结果输出目录，默认为当前目录")
+    parser.add_argument("--check", action="store_true", help="开启数据检查")
+    parser.add_argument("--engine", choices=["python", "numpy"], default="python", help="工时计算引擎")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="并行处理的进程数，为0时按CPU核数启动")
+    parser.add_argument("--stream", action="store_true", help="流式处理，内存占用不随数据规模增长")
+    parser.add_argument("--allocation", choices=["float", "last", "largest"], default="float",
+                        help="工时分配方式：float 浮点逐项舍入（默认）；last 按分计算，最后一个项目取剩余工时；"
+                             "largest 按分计算，最大余数法分配")
+    parser.add_argument("--reader", choices=["auto", "fast", "openpyxl"], default="auto", help="表格读取方式")
+    parser.add_argument("--cache", default=None, help="缓存目录，复用未变化的月份及项目成员信息")
+    parser.add_argument("--year", default=None, help="工时数据所属年份，默认从文件名中获取")
+    parser.add_argument("--db", default=None, help="SQLite数据库文件，工时分配结果同时写入数据库，重新处理的月份覆盖旧数据")
+    parser.add_argument("--format", choices=["xlsx", "csv", "parquet"], default="xlsx",
+                        help="输出格式：xlsx 结果表；csv、parquet 输出到以TimeResults_原文件名命名的目录，每个月份一个文件，"
+                             "parquet需要安装pyarrow")
+    parser.add_argument("--shard", choices=["month", "project"], default=None,
+                        help="分片输出：month 每个月份、project 每个项目生成一个结果表，保存在TimeResults_原文件名目录中，"
+                             "附带记录行数及校验值的manifest.json，配合 -j 并行写入")
+    parser.add_argument("--summary", choices=["sheets", "file"], default=None,
+                        help="生成项目、人员的月度工时汇总：sheets 追加到结果表，file 单独保存为TimeSummary_原文件名")
+    parser.add_argument("--validate", default=None,
+                        help="校验报告文件（.json或.xlsx）：单独批量校验工时数据及项目起止时间，按类别汇总问题数量及样例")
+    parser.add_argument("--merge", default=None,
+                        help="合并处理：所有工时数据表（可跨年度）合并生成一个TimeResults_合并结果名称，月份按时间排序")
+    parser.add_argument("--window", default=None, help="合并处理的月份范围，如 2021-04:2022-03")
+    parser.add_argument("--progress", action="store_true", help="定时输出处理进度、吞吐量及预计剩余时间")
+    parser.add_argument("--log", default=None, help="日志文件")
+    parser.add_argument("--metrics", default=None, help="运行统计JSON文件，记录各阶段及各月份的耗时、数据量和内存峰值")
+    parser.add_argument("--profile", default=None, help="cProfile性能分析结果文件")
+    parser.add_argument("--watch", default=None, help="常驻服务模式：监视投递目录，自动处理新增或修改的工时数据表")
+    parser.add_argument("--port", type=int, default=None, help="常驻服务模式：启动本地HTTP接口，用于提交任务及查询状态")
+    parser.add_argument("--interval", type=float, default=2.0, help="常驻服务模式下的轮询间隔（秒）")
+    args = parser.parse_args(argv[1:])
+    service = args.watch is not None or args.port is not None
+
+    if not os.path.isfile(args.project):
+        print(f"找不到成员项目信息表文件: {args.project}")
         return False
-    log = LogTrace()
-    data_file = argv[1]
-    if not os.path.isfile(data_file):
-        if not os.path.isfile(os.path.join(os.getcwd(), data_file)):
-            print(f"找不到工时数据表文件: {data_file}")
-            return False
-    project_file = argv[2]
-    if not os.path.isfile(project_file):
-        if not os.path.isfile(os.path.join(os.getcwd(), project_file)):
-            print(f"找不到成员项目信息表文件: {project_file}")
+    data_files = find_data_files(args.data, args.project)
+    if data_files is None:
+        return False
+    if len(data_files) <= 0 and not service:
+        print(f" ERR: 未找到需要处理的工时数据表。")
+        return False
+    if args.watch is not None and not os.path.isdir(args.watch):
+        print(f"找不到投递目录: {args.watch}")
+        return False
+    window = None
+    if args.window is not None:
+        window = parse_window(args.window)
+        if window is None:
+            print(f"月份范围格式错误: {args.window}，应为 起始年-月:结束年-月，如 2021-04:2022-03")
             return False
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
 
-    checked = False
-    if len(argv) == 4:
-        if argv[3].upper() == "TRUE":
-            checked = True
-        elif argv[3].upper() == "FALSE":
-            checked = False
-        else:
-            print(f" ERR: 命令参数错误。")
-            print(f" 示例: {argv[0]} <工时数据信息表.xlsx> <项目成员信息表.xlsx> [True|False]")
-
-    DataProcess(log, data_file, project_file).run(checked)
+    log = LogTrace()
+    log.init_log(None, args.log)
+    options = {'engine': args.engine, 'jobs': args.jobs or os.cpu_count() or 1, 'stream': args.stream,
+               'reader': args.reader, 'cache_dir': args.cache, 'year': args.year, 'metrics_file': args.metrics,
+               'profile_file': args.profile, 'allocation': args.allocation, 'database': args.db,
+               'summary': args.summary, 'output': args.format, 'validate_file': args.validate, 'shard': args.shard}
+    if service:
+        watcher = WatchService(log, args.project, args.watch, args.out_dir, args.interval, checked=args.check, **options)
+        for data_file in data_files:
+            watcher.submit(data_file)
+        return watcher.serve(args.port)
+
+    # 按Ctrl+C时取消处理并丢弃未完成的结果，再次按Ctrl+C立即退出
+    progress = Progress(lambda state: log.info(state.text())) if args.progress else Progress()
+
+    def interrupt(signum, frame):
+        if progress.cancelled.is_set():
+            raise KeyboardInterrupt
+        print(f"正在取消处理，再次按 Ctrl+C 立即退出 ...", file=sys.stderr)
+        progress.cancel()
+
+    signal.signal(signal.SIGINT, interrupt)
+    return DataProcess(log, data_files, args.project, args.out_dir).run(args.check, merge=args.merge, window=window,
+                                                                        progress=progress, **options)
 
 
 if '__main__' == __name__:
-    # cmd_main(sys.argv)
+    multiprocessing.freeze_support()  # 支持打包后的可执行程序在Windows上启动子进程
+    # 带参数运行时使用命令行模式，否则启动图形界面
+    if len(sys.argv) > 1:
+        sys.exit(0 if cmd_main(sys.argv) else 1)
     app_main()